@@ -0,0 +1,273 @@
+# Pick popularity, maximum attainable points and "what if" projections for one tournament. Every table is read once
+# into a DataFrame and the numbers come from joins and group-bys over all players at once, never a loop per player.
+import itertools
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import scoring
+from models import db, users, knockout_matches, knockout_picks, picks, matches, scores, groups, stages
+
+# a group with more matches left than this is not enumerated, every ordered pair of its teams counts as possible
+MAX_ENUMERATED_MATCHES = 9
+
+
+def read(query):
+    return pd.read_sql(query.statement, db.session.connection())
+
+
+def load_frames(tournament_id):
+    group_ids = db.session.query(groups._id).filter_by(tournament_id=tournament_id)
+    return dict(
+        groups=read(db.session.query(groups._id.label('group_id'), groups.team_1_id, groups.team_2_id,
+                                     groups.team_3_id, groups.team_4_id)
+                    .filter_by(tournament_id=tournament_id).order_by(groups._id)),
+        matches=read(db.session.query(matches._id.label('match_id'), matches.team_1_id, matches.team_2_id,
+                                      matches.team_1_goals, matches.team_2_goals, matches.is_played)
+                     .filter_by(tournament_id=tournament_id)),
+        picks=read(db.session.query(picks.user_id, picks.group_id, picks.first_seed_id, picks.second_seed_id)
+                   .filter(picks.group_id.in_(group_ids))),
+        knockout_matches=read(db.session.query(knockout_matches._id.label('knockout_match_id'),
+                                               knockout_matches.team_1_id, knockout_matches.team_2_id,
+                                               knockout_matches.winner, knockout_matches.is_played,
+                                               knockout_matches.match_date)
+                              .filter_by(tournament_id=tournament_id)),
+        knockout_picks=read(db.session.query(knockout_picks.user_id, knockout_picks.knockout_match_id,
+                                             knockout_picks.winner)
+                            .join(knockout_matches, knockout_matches._id == knockout_picks.knockout_match_id)
+                            .filter(knockout_matches.tournament_id == tournament_id)),
+        stages=read(db.session.query(stages.start_date, stages.end_date, stages.points)
+                    .filter_by(tournament_id=tournament_id).order_by(stages._id)),
+        scores=read(db.session.query(scores.user_id, users.name, scores.group_points, scores.knockout_points,
+                                     scores.total_points)
+                    .join(users, users._id == scores.user_id).filter(scores.tournament_id == tournament_id)),
+    )
+
+
+def group_teams(frames):
+    # long format (group_id, position, team_id) in group order, the order group_seeds breaks ties with
+    teams = frames['groups'].melt(id_vars='group_id', value_vars=['team_1_id', 'team_2_id', 'team_3_id', 'team_4_id'],
+                                  var_name='position', value_name='team_id').dropna(subset=['team_id'])
+    teams['position'] = teams['position'].str[5].astype(int)
+    teams['team_id'] = teams['team_id'].astype(int)
+    return teams.sort_values(['group_id', 'position']).reset_index(drop=True)
+
+
+def team_points(played_matches):
+    # (team_id, points, played) from the played matches, 3 for a win and 1 for a draw
+    goals_1 = played_matches['team_1_goals'].astype(int)
+    goals_2 = played_matches['team_2_goals'].astype(int)
+    long = pd.concat([
+        pd.DataFrame(dict(team_id=played_matches['team_1_id'],
+                          points=np.select([goals_1 > goals_2, goals_1 == goals_2], [3, 1], 0))),
+        pd.DataFrame(dict(team_id=played_matches['team_2_id'],
+                          points=np.select([goals_2 > goals_1, goals_1 == goals_2], [3, 1], 0))),
+    ])
+    return long.groupby('team_id')['points'].agg(points='sum', played='size')
+
+
+def seed_pairs(team_ids, points, remaining, forced_winner=None):
+    # every (first seed, second seed) the group can still end with. team_ids in group order, points the current
+    # points, remaining the (team_1_id, team_2_id) matches left. forced_winner wins all of its remaining matches.
+    team_ids = np.asarray(team_ids)
+    if len(remaining) > MAX_ENUMERATED_MATCHES:
+        return {(first, second) for first, second in itertools.permutations(team_ids.tolist(), 2)}
+    position = {team_id: index for index, team_id in enumerate(team_ids.tolist())}
+    choices = []
+    for team_1, team_2 in remaining:
+        if forced_winner == team_1:
+            choices.append((3,))
+        elif forced_winner == team_2:
+            choices.append((0,))
+        else:
+            choices.append((3, 1, 0))
+    # outcomes[s, m] is the first team's points in match m of scenario s
+    outcomes = np.array(list(itertools.product(*choices)), dtype=int).reshape(-1, len(remaining))
+    other = np.where(outcomes == 1, 1, 3 - outcomes)
+    first_team = np.zeros((len(remaining), len(team_ids)), dtype=int)
+    second_team = np.zeros((len(remaining), len(team_ids)), dtype=int)
+    for match_index, (team_1, team_2) in enumerate(remaining):
+        first_team[match_index, position[team_1]] = 1
+        second_team[match_index, position[team_2]] = 1
+    final = np.asarray(points, dtype=int) + outcomes @ first_team + other @ second_team
+    # ties go to the earlier team, like scoring.group_seeds
+    key = final * len(team_ids) + (len(team_ids) - 1 - np.arange(len(team_ids)))
+    first = key.argmax(axis=1)
+    key[np.arange(len(key)), first] = -1
+    second = key.argmax(axis=1)
+    return set(zip(team_ids[first].tolist(), team_ids[second].tolist()))
+
+
+def group_outlook(frames, forced_winner=None):
+    # (group_id, first_seed, second_seed) rows of every seed pair each group can finish with, and the ids of the
+    # groups whose result is already known
+    teams = group_teams(frames)
+    match_frame = frames['matches']
+    played = match_frame[match_frame['is_played'].fillna(False).astype(bool)]
+    points = team_points(played)
+    teams = teams.join(points, on='team_id')
+    teams[['points', 'played']] = teams[['points', 'played']].fillna(0).astype(int)
+    group_of_team = teams.set_index('team_id')['group_id']
+    unplayed = match_frame[~match_frame['is_played'].fillna(False).astype(bool)]
+    unplayed = unplayed[unplayed['team_1_id'].isin(group_of_team.index) & unplayed['team_2_id'].isin(group_of_team.index)]
+    unplayed_group = unplayed['team_1_id'].map(group_of_team)
+
+    rows = []
+    decided = []
+    for group_id, group in teams.groupby('group_id', sort=False):
+        remaining = list(unplayed.loc[unplayed_group == group_id, ['team_1_id', 'team_2_id']]
+                         .itertuples(index=False, name=None))
+        # a group only scores once every team has played every other team
+        if group['played'].sum() + 2 * len(remaining) != scoring.complete_group_played(len(group)):
+            continue
+        if not remaining:
+            decided.append(group_id)
+            pairs = {scoring.group_seeds(list(zip(group['team_id'], group['points'])))}
+        else:
+            pairs = seed_pairs(group['team_id'], group['points'], remaining, forced_winner)
+        rows += [(group_id, first, second) for first, second in pairs]
+    outlook = pd.DataFrame(rows, columns=['group_id', 'first_seed', 'second_seed'])
+    return outlook, decided
+
+
+def pick_points(frame):
+    # scoring.pick_points over whole columns
+    first_pick, second_pick = frame['first_seed_id'], frame['second_seed_id']
+    first_seed, second_seed = frame['first_seed'], frame['second_seed']
+    return np.select(
+        [(first_pick == first_seed) & (second_pick == second_seed),
+         (first_pick == second_seed) & (second_pick == first_seed),
+         (first_pick == first_seed) | (first_pick == second_seed) |
+         (second_pick == first_seed) | (second_pick == second_seed)],
+        [3, 2, 1], 0)
+
+
+def pick_range(frames, outlook):
+    # (user_id, group_id, low, high) points each pick can still be worth over the seed pairs in outlook
+    merged = frames['picks'].merge(outlook, on='group_id')
+    merged['points'] = pick_points(merged)
+    return merged.groupby(['user_id', 'group_id'])['points'].agg(low='min', high='max').reset_index()
+
+
+def knockout_match_points(frames):
+    # points per knockout match from the stage its date falls in, the first matching stage wins like in scoring
+    match_frame = frames['knockout_matches']
+    match_dates = pd.to_datetime(match_frame['match_date'])
+    points = pd.Series(1, index=match_frame.index)
+    for stage in frames['stages'].iloc[::-1].itertuples():
+        inside = pd.Series(True, index=match_frame.index)
+        if pd.notna(stage.start_date):
+            inside &= match_dates >= pd.Timestamp(stage.start_date)
+        if pd.notna(stage.end_date):
+            inside &= match_dates <= pd.Timestamp(stage.end_date)
+        points[inside] = stage.points
+    return pd.Series(points.values, index=match_frame['knockout_match_id'])
+
+
+def players(frames):
+    # every player with a score or a pick, with name and current points
+    user_ids = pd.Index(pd.concat([frames['scores']['user_id'], frames['picks']['user_id'],
+                                   frames['knockout_picks']['user_id']]).unique(), name='user_id')
+    table = frames['scores'].set_index('user_id').reindex(user_ids)
+    table[['group_points', 'knockout_points', 'total_points']] = \
+        table[['group_points', 'knockout_points', 'total_points']].fillna(0).astype(int)
+    return table
+
+
+def pick_distribution(frames):
+    # how often each team is picked first and second per group, and as winner per knockout match
+    pick_frame = frames['picks']
+    first = pick_frame.groupby(['group_id', 'first_seed_id']).size()
+    second = pick_frame.groupby(['group_id', 'second_seed_id']).size()
+    first.index.names = second.index.names = ['group_id', 'team_id']
+    group_table = pd.concat([first.rename('first'), second.rename('second')], axis=1).fillna(0).astype(int)
+    pickers = pick_frame.groupby('group_id').size()
+    group_table['first_share'] = group_table['first'] / pickers.reindex(group_table.index.get_level_values(0)).values
+    group_table['second_share'] = group_table['second'] / pickers.reindex(group_table.index.get_level_values(0)).values
+
+    knockout_frame = frames['knockout_picks']
+    knockout_table = knockout_frame.groupby(['knockout_match_id', 'winner']).size().rename('picks').to_frame()
+    knockout_table['share'] = knockout_table['picks'] / knockout_frame.groupby('knockout_match_id').size() \
+        .reindex(knockout_table.index.get_level_values(0)).values
+    return group_table, knockout_table
+
+
+def max_points(frames, today=None):
+    # the most points every player can still reach: picks in unfinished groups at their best outcome, groups not
+    # picked yet at 3 while they have not started, and every knockout match still open at the picked winner
+    today = today or date.today()
+    table = players(frames)
+    group_count = len(frames['groups'])
+    outlook, decided = group_outlook(frames)
+    ranges = pick_range(frames, outlook)
+    undecided = ranges[~ranges['group_id'].isin(decided)]
+
+    # a player needs a pick in every group to score any group points
+    match_frame = frames['matches']
+    teams = group_teams(frames)
+    played_teams = pd.concat([match_frame.loc[match_frame['is_played'].fillna(False).astype(bool), 'team_1_id'],
+                              match_frame.loc[match_frame['is_played'].fillna(False).astype(bool), 'team_2_id']])
+    started = set(teams.loc[teams['team_id'].isin(played_teams), 'group_id'])
+    open_groups = set(frames['groups']['group_id']) - started
+    pick_count = frames['picks'].groupby('user_id').size().reindex(table.index, fill_value=0)
+    open_picked = frames['picks'][frames['picks']['group_id'].isin(open_groups)].groupby('user_id').size() \
+        .reindex(table.index, fill_value=0)
+    missing_started = (group_count - len(open_groups)) - (pick_count - open_picked)
+    can_score_groups = (missing_started == 0) & (group_count > 0)
+    still_to_pick = len(open_groups) - open_picked
+
+    group_potential = undecided.groupby('user_id')['high'].sum().reindex(table.index, fill_value=0)
+    group_potential += 3 * still_to_pick
+    # a group that is decided is in group_points already, but only once the player's picks are complete
+    decided_points = ranges[ranges['group_id'].isin(decided)].groupby('user_id')['high'].sum() \
+        .reindex(table.index, fill_value=0)
+    group_max = np.where(can_score_groups, decided_points + group_potential, 0)
+
+    match_points = knockout_match_points(frames)
+    knockout_frame = frames['knockout_matches']
+    unplayed = knockout_frame.loc[~knockout_frame['is_played'].fillna(False).astype(bool), 'knockout_match_id']
+    pickable = knockout_frame.loc[~knockout_frame['is_played'].fillna(False).astype(bool) &
+                                  (pd.to_datetime(knockout_frame['match_date']) > pd.Timestamp(today)),
+                                  'knockout_match_id']
+    knockout_pick_frame = frames['knockout_picks']
+    picked_open = knockout_pick_frame[knockout_pick_frame['knockout_match_id'].isin(unplayed)]
+    picked_open = picked_open.assign(points=picked_open['knockout_match_id'].map(match_points))
+    picked_pickable = picked_open[picked_open['knockout_match_id'].isin(pickable)]
+    knockout_potential = picked_open.groupby('user_id')['points'].sum().reindex(table.index, fill_value=0)
+    knockout_potential += match_points.reindex(pickable).sum() - \
+        picked_pickable.groupby('user_id')['points'].sum().reindex(table.index, fill_value=0)
+
+    table['max_group_points'] = group_max.astype(int)
+    table['max_knockout_points'] = (table['knockout_points'] + knockout_potential).astype(int)
+    table['max_total_points'] = table['max_group_points'] + table['max_knockout_points']
+    return table.sort_values(['max_total_points', 'total_points'], ascending=False)
+
+
+def what_if(frames, team_id):
+    # the leaderboard if team_id wins every match it has left: its group and knockout matches are settled, the
+    # other matches of its group can still go any way, so every player gets a low and a high projection
+    table = players(frames)
+    outlook, decided = group_outlook(frames, forced_winner=team_id)
+    teams = group_teams(frames)
+    team_groups = set(teams.loc[teams['team_id'] == team_id, 'group_id']) - set(decided)
+    ranges = pick_range(frames, outlook[outlook['group_id'].isin(team_groups)])
+    group_count = len(frames['groups'])
+    complete_picks = frames['picks'].groupby('user_id').size().reindex(table.index, fill_value=0) == group_count
+    low = ranges.groupby('user_id')['low'].sum().reindex(table.index, fill_value=0).where(complete_picks, 0)
+    high = ranges.groupby('user_id')['high'].sum().reindex(table.index, fill_value=0).where(complete_picks, 0)
+
+    knockout_frame = frames['knockout_matches']
+    team_matches = knockout_frame[~knockout_frame['is_played'].fillna(False).astype(bool) &
+                                  ((knockout_frame['team_1_id'] == team_id) |
+                                   (knockout_frame['team_2_id'] == team_id))]['knockout_match_id']
+    knockout_pick_frame = frames['knockout_picks']
+    winning = knockout_pick_frame[knockout_pick_frame['knockout_match_id'].isin(team_matches) &
+                                  (knockout_pick_frame['winner'] == team_id)]
+    knockout_gain = winning['knockout_match_id'].map(knockout_match_points(frames)).groupby(winning['user_id']) \
+        .sum().reindex(table.index, fill_value=0)
+
+    table['projected_low'] = (table['total_points'] + low + knockout_gain).astype(int)
+    table['projected_high'] = (table['total_points'] + high + knockout_gain).astype(int)
+    table['projected_rank'] = table['projected_high'].rank(method='min', ascending=False).astype(int)
+    return table.sort_values(['projected_high', 'projected_low'], ascending=False)
@@ -1,296 +1,659 @@
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, session
+from datetime import datetime
+import click
+import json
+from flask import Blueprint, Flask, render_template, request, redirect, url_for, session, jsonify, current_app
 from flask_login import (
     LoginManager,
     current_user,
-    login_required,
     login_user,
-    logout_user,
-    UserMixin,
 )
 from oauthlib.oauth2 import WebApplicationClient
 import os
-import requests
-import json
-from flask_sqlalchemy import SQLAlchemy
-import psycopg2
-from config import config
-
-app = Flask(__name__)
+from config import settings
+import scoring
+from models import db, users, knockout_matches, knockout_picks, picks, matches, scores, standings, \
+    groups, tournaments, stages, pools, pool_members, country_cache, upsert
+import migrations
+from results_import import parse_results, ResultsImportError
+from instrumentation import QueryStats
+from page_cache import PageCache
+from live import LiveBroadcaster
+from jobs import ScoreJobRunner
+from assets import AssetManifest
+import assets
+import analytics
+import snapshots
+import oidc
 
 # Configuration
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID", None)
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET", None)
-GOOGLE_DISCOVERY_URL = (
-    "https://accounts.google.com/.well-known/openid-configuration"
+GOOGLE_DISCOVERY_URL = os.environ.get(
+    "GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration"
 )
 
-params = config('db.ini')
-conn = psycopg2.connect(**params)
-user = params.get('user')
-password = params.get('password')
-host = params.get('host')
-database = params.get('database')
-DATABASE_URI = f'postgresql://{user}:{password}@{host}/{database}'
-app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.permanent_session_lifetime = timedelta(minutes=20)
-app.secret_key = 'cactus'
-app.permanent_session_lifetime = timedelta(minutes=2000000)
-db = SQLAlchemy(app)
+bp = Blueprint('main', __name__, cli_group=None)
+query_stats = QueryStats()
+page_cache = PageCache()
+live = LiveBroadcaster()
+scoring_jobs = ScoreJobRunner()
+asset_manifest = AssetManifest()
+login_manager = LoginManager()
+http_session = oidc.make_session()
+google_provider_cfg_cache = oidc.DiscoveryCache(GOOGLE_DISCOVERY_URL, http_session)
+
+
+def is_admin():
+    return session.get('id') in current_app.config['ADMIN_USER_IDS']
 
 
 def get_google_provider_cfg():
-    return requests.get(GOOGLE_DISCOVERY_URL).json()
-
-
-# models
-class users(db.Model, UserMixin):
-    _id = db.Column("id", db.String(500), primary_key=True)
-    email = db.Column(db.String(500))
-    name = db.Column(db.String(500))
-
-    def knockout_points(self):
-        points = 0
-        all_picks_k = knockout_picks.query.filter_by(user_id=self._id).all()
-        for p in all_picks_k:
-            knockout_match = knockout_matches.query.filter_by(_id=p.knockout_match_id).first()
-            if knockout_match.is_played == True:
-                if p.winner == knockout_match.winner:
-                    if knockout_match.match_date > datetime(2022, 12, 11).date():
-                        points += 2
-                    elif knockout_match.match_date > datetime(2022, 12, 15).date():
-                        points += 4
-                    else:
-                        points += 1
-        return points
-
-    def calc_points(self):
-        # 3 points for 2 correct teams + order
-        # 2 points for 2 correct teams + incorrect order
-        # 1 point for 1 correct team in any order.
-        points = 0
-        if len(picks.query.filter_by(user_id=self._id).all()) == 8:
-            all_groups = groups.query.all()
-            for group in all_groups:
-                played = 0
-                teams = [group.team_1_id, group.team_2_id, group.team_3_id, group.team_4_id]
-                for team in teams:
-                    played += group.get_played_by_team(team)
-                if played == 12:
-                    first_pick = picks.query.filter_by(user_id=self._id, group_id=group._id).first().first_seed_id
-                    second_pick = picks.query.filter_by(user_id=self._id, group_id=group._id).first().second_seed_id
-                    team_1_points = group.team_1_points
-                    team_2_points = group.team_2_points
-                    team_3_points = group.team_3_points
-                    team_4_points = group.team_4_points
-                    team_1_tuple = (group.team_1_id, team_1_points)
-                    team_2_tuple = (group.team_2_id, team_2_points)
-                    team_3_tuple = (group.team_3_id, team_3_points)
-                    team_4_tuple = (group.team_4_id, team_4_points)
-                    team_tuples = [team_1_tuple, team_2_tuple, team_3_tuple, team_4_tuple]
-                    first_seed_tuple = max(team_tuples, key=lambda item: item[1])
-                    first_seed = first_seed_tuple[0]
-                    team_tuples.remove(first_seed_tuple)
-                    second_seed = max(team_tuples, key=lambda item: item[1])[0]
-
-                    if first_pick == first_seed and second_pick == second_seed:
-                        points += 3
-                    elif first_pick == second_seed and second_pick == first_seed:
-                        points += 2
-                    elif first_pick == first_seed or first_pick == second_seed or second_pick == first_seed or second_pick == second_seed:
-                        points += 1
-        return points
-
-    def has_picks(self):
-        has_pick = picks.query.filter_by(user_id=self._id).count()
-        return has_pick
-
-    def get_id(self):
-        return self._id
-
-    def __init__(self, _id, email, name):
-        self._id = _id
-        self.email = email
-        self.name = name
-
-
-class knockout_matches(db.Model):
-    _id = db.Column("id", db.Integer, primary_key=True)
-    team_1_id = db.Column(db.Integer)
-    team_2_id = db.Column(db.Integer)
-    winner = db.Column(db.Integer)
-    is_played = db.Column(db.Boolean)
-    match_date = db.Column(db.Date)
-
-    def user_picked(self, user_id):
-        if len(knockout_picks.query.filter_by(user_id=user_id, knockout_match_id=self._id).all()):
-            return True
+    return google_provider_cfg_cache.get()
+
+
+def current_tournament_id():
+    # ?tournament_id= for API clients, otherwise the one chosen on the home page, otherwise the default
+    tournament_id = request.args.get('tournament_id', type=int) or session.get('tournament_id')
+    return tournament_id or current_app.config['DEFAULT_TOURNAMENT_ID']
+
+
+def tournament_ids():
+    return [item[0] for item in db.session.query(tournaments._id).order_by(tournaments._id).all()]
+
+
+def rank_scores(tournament_id):
+    # competition ranking: equal totals share a rank, the next rank skips ahead. Only players on the leaderboard
+    # (see leaderboard_query) are ranked, the others have no rank.
+    rank = 0
+    position = 0
+    previous_total = None
+    changed_ranks = []
+    score_list = db.session.query(scores.user_id, scores.total_points, scores.group_points, scores.rank) \
+        .filter_by(tournament_id=tournament_id).order_by(scores.total_points.desc(), scores.user_id).all()
+    for user_id, total_points, group_points, old_rank in score_list:
+        new_rank = None
+        if group_points > 0:
+            position += 1
+            if total_points != previous_total:
+                rank = position
+                previous_total = total_points
+            new_rank = rank
+        if new_rank != old_rank:
+            changed_ranks.append(dict(tournament_id=tournament_id, user_id=user_id, rank=new_rank))
+    if changed_ranks:
+        db.session.execute(db.update(scores), changed_ranks)
+
+
+def calc_all_points(tournament_id, user_ids=None):
+    # bulk version of users.calc_points/users.knockout_points for one tournament, a handful of queries for any
+    # number of users. Without user_ids it scores everyone with a pick in the tournament.
+    group_list = []
+    for group in groups.query.filter_by(tournament_id=tournament_id).all():
+        team_tuples = [(team_id, points) for team_id, points in (
+            (group.team_1_id, group.team_1_points), (group.team_2_id, group.team_2_points),
+            (group.team_3_id, group.team_3_points), (group.team_4_id, group.team_4_points)) if team_id is not None]
+        group_list.append((group._id, team_tuples))
+    played = dict(db.session.query(standings.team_id, standings.played).filter_by(tournament_id=tournament_id).all())
+    stage_list = db.session.query(stages.start_date, stages.end_date, stages.points) \
+        .filter_by(tournament_id=tournament_id).order_by(stages._id).all()
+
+    pick_query = db.session.query(picks.user_id, picks.group_id, picks.first_seed_id, picks.second_seed_id) \
+        .filter(picks.group_id.in_([group_id for group_id, _ in group_list]))
+    knockout_query = db.session.query(knockout_picks.user_id, knockout_matches.match_date, db.func.count()) \
+        .join(knockout_matches, knockout_matches._id == knockout_picks.knockout_match_id) \
+        .filter(knockout_matches.tournament_id == tournament_id, knockout_matches.is_played == True,
+                knockout_picks.winner == knockout_matches.winner) \
+        .group_by(knockout_picks.user_id, knockout_matches.match_date)
+    if user_ids is not None:
+        pick_query = pick_query.filter(picks.user_id.in_(user_ids))
+        knockout_query = knockout_query.filter(knockout_picks.user_id.in_(user_ids))
+
+    pick_list = pick_query.order_by(picks._id).all()
+    points_groups = scoring.group_points(group_list, played, pick_list)
+    points_knockout = scoring.knockout_points(knockout_query.all(), stage_list)
+    if user_ids is None:
+        user_ids = {item[0] for item in pick_list}
+        user_ids |= {item[0] for item in db.session.query(knockout_picks.user_id)
+                     .join(knockout_matches, knockout_matches._id == knockout_picks.knockout_match_id)
+                     .filter(knockout_matches.tournament_id == tournament_id).distinct().all()}
+    return {user_id: (points_groups.get(user_id, 0), points_knockout.get(user_id, 0)) for user_id in user_ids}
+
+
+def tournament_players(tournament_id):
+    group_ids = db.session.query(groups._id).filter_by(tournament_id=tournament_id)
+    user_ids = {item[0] for item in db.session.query(picks.user_id).filter(picks.group_id.in_(group_ids)).distinct()}
+    user_ids |= {item[0] for item in db.session.query(knockout_picks.user_id)
+                 .join(knockout_matches, knockout_matches._id == knockout_picks.knockout_match_id)
+                 .filter(knockout_matches.tournament_id == tournament_id).distinct()}
+    return user_ids
+
+
+def write_scores(tournament_id, user_ids=None):
+    # stores the recalculated scoreboard rows of the given players, or all of the tournament's, without ranking.
+    # Returns the number of players whose points changed, a new player without points is not a change.
+    all_points = calc_all_points(tournament_id, user_ids)
+    score_list = db.session.query(scores.user_id, scores.group_points, scores.knockout_points) \
+        .filter_by(tournament_id=tournament_id)
+    if user_ids is not None:
+        score_list = score_list.filter(scores.user_id.in_(all_points.keys()))
+    stored_points = {user_id: (points, points_knockout) for user_id, points, points_knockout in score_list.all()}
+    new_rows = []
+    changed_rows = []
+    for user_id, (points, points_knockout) in all_points.items():
+        row = dict(tournament_id=tournament_id, user_id=user_id, group_points=points, knockout_points=points_knockout,
+                   total_points=points + points_knockout)
+        if user_id not in stored_points:
+            new_rows.append(row)
+        elif stored_points[user_id] != (points, points_knockout):
+            changed_rows.append(row)
+    # one executemany each instead of a statement per user
+    if new_rows:
+        db.session.execute(db.insert(scores), new_rows)
+    if changed_rows:
+        db.session.execute(db.update(scores), changed_rows)
+    return len(changed_rows) + sum(1 for row in new_rows if row['total_points'])
+
+
+def update_scores(tournament_id, user_ids=None):
+    # recalculates the tournament's stored scoreboard rows, all of its players when user_ids is None
+    if user_ids is not None and not user_ids:
+        return
+    changed = write_scores(tournament_id, user_ids)
+    rank_scores(tournament_id)
+    db.session.commit()
+    # new players signing up change the roster but not the standings, history only follows points
+    if changed:
+        snapshots.take(tournament_id)
+    page_cache.bump(f'scoreboard-{tournament_id}')
+
+
+def recompute_scores(tournament_id, user_ids, progress, batch_size):
+    # the score job: players in batches with progress after each one, ranked and committed once at the end so
+    # readers never see new totals with old ranks
+    user_ids = sorted(tournament_players(tournament_id) if user_ids is None else user_ids)
+    changed = 0
+    for start in range(0, len(user_ids), batch_size):
+        changed += write_scores(tournament_id, user_ids[start:start + batch_size])
+        progress(min(start + batch_size, len(user_ids)), len(user_ids))
+    rank_scores(tournament_id)
+    db.session.commit()
+    if changed:
+        snapshots.take(tournament_id)
+    page_cache.bump(f'scoreboard-{tournament_id}')
+
+
+def count_standings(tournament_id):
+    # full recount from the matches table into the session, the caller commits
+    standings.query.filter_by(tournament_id=tournament_id).delete()
+    group_list = groups.query.filter_by(tournament_id=tournament_id).all()
+    standing_by_team = {}
+    for group in group_list:
+        for team_id in group.team_ids():
+            standing_by_team[team_id] = standings(tournament_id, team_id, group._id)
+            db.session.add(standing_by_team[team_id])
+    for match in matches.query.filter_by(tournament_id=tournament_id, is_played=True).all():
+        result_1, result_2 = scoring.match_result(int(match.team_1_goals), int(match.team_2_goals))
+        if match.team_1_id in standing_by_team and match.team_2_id in standing_by_team:
+            standing_by_team[match.team_1_id].apply(result_1)
+            standing_by_team[match.team_2_id].apply(result_2)
+    for group in group_list:
+        for team_id in group.team_ids():
+            group.set_team_points(team_id, standing_by_team[team_id].points)
+
+
+def rebuild_standings(tournament_id):
+    # the result entry routes keep the standings up to date afterwards
+    count_standings(tournament_id)
+    db.session.commit()
+    page_cache.bump(f'groups-{tournament_id}')
+
+
+def match_standings(match):
+    return standings.query.filter(standings.tournament_id == match.tournament_id,
+                                  standings.team_id.in_([match.team_1_id, match.team_2_id])).all()
+
+
+def apply_match_result(match, team_1_goals, team_2_goals):
+    # moves both teams' standings by the difference between the stored and the new result. The match must be
+    # between two teams of one group, import_results checks that.
+    team_standings = match_standings(match)
+    if len(team_standings) != 2:
+        # standings that were never filled, counted inside the caller's transaction
+        count_standings(match.tournament_id)
+        team_standings = match_standings(match)
+    standing_by_team = {standing.team_id: standing for standing in team_standings}
+    standing_1 = standing_by_team[match.team_1_id]
+    standing_2 = standing_by_team[match.team_2_id]
+    if match.is_played:
+        old_result_1, old_result_2 = scoring.match_result(int(match.team_1_goals), int(match.team_2_goals))
+        standing_1.apply(old_result_1, -1)
+        standing_2.apply(old_result_2, -1)
+    result_1, result_2 = scoring.match_result(team_1_goals, team_2_goals)
+    standing_1.apply(result_1)
+    standing_2.apply(result_2)
+    match.is_played = True
+    match.team_1_goals = team_1_goals
+    match.team_2_goals = team_2_goals
+
+    group = db.session.get(groups, standing_1.group_id)
+    group.set_team_points(standing_1.team_id, standing_1.points)
+    group.set_team_points(standing_2.team_id, standing_2.points)
+    return group._id
+
+
+def apply_knockout_winner(knockout_match, winner):
+    knockout_match.winner = winner
+    knockout_match.is_played = True
+
+
+def import_results(tournament_id, match_results, knockout_results):
+    # validates the whole batch, applies it in one transaction and rescores the affected users once
+    errors = []
+    match_ids = [row.get('match_id') for row in match_results]
+    knockout_ids = [row.get('knockout_match_id') for row in knockout_results]
+    try:
+        match_ids = [int(match_id) for match_id in match_ids]
+        knockout_ids = [int(match_id) for match_id in knockout_ids]
+    except (TypeError, ValueError):
+        return [dict(error='every row needs a numeric match_id or knockout_match_id')], []
+    match_by_id = {match._id: match for match in
+                   matches.query.filter(matches.tournament_id == tournament_id, matches._id.in_(match_ids))}
+    knockout_by_id = {match._id: match for match in
+                      knockout_matches.query.filter(knockout_matches.tournament_id == tournament_id,
+                                                    knockout_matches._id.in_(knockout_ids))}
+
+    group_of_team = {team_id: group._id for group in groups.query.filter_by(tournament_id=tournament_id)
+                     for team_id in group.team_ids()}
+
+    planned = []
+    for match_id, row in zip(match_ids, match_results):
+        match = match_by_id.get(match_id)
+        try:
+            goals = (int(row['team_1_goals']), int(row['team_2_goals']))
+        except (KeyError, TypeError, ValueError):
+            errors.append(dict(match_id=match_id, error='team_1_goals and team_2_goals are required numbers'))
+            continue
+        if match is None:
+            errors.append(dict(match_id=match_id, error='unknown match'))
+        elif match_ids.count(match_id) > 1:
+            errors.append(dict(match_id=match_id, error='match appears more than once'))
+        elif min(goals) < 0:
+            errors.append(dict(match_id=match_id, error='goals cannot be negative'))
+        elif group_of_team.get(match.team_1_id) is None or \
+                group_of_team.get(match.team_1_id) != group_of_team.get(match.team_2_id):
+            errors.append(dict(match_id=match_id, error='match is not between two teams of one group'))
         else:
-            return False
-
-    def get_pick_by_user(self, user_id):
-        return countries.query.filter_by(_id=knockout_picks.query.filter_by(user_id=user_id, knockout_match_id=self._id).first().winner).first().name
-
-    def get_winner_country(self):
-        return countries.query.filter_by(_id=self.winner).first().name
-
-    def get_country_1(self):
-        return countries.query.filter_by(_id=self.team_1_id).first().name
-
-    def get_country_2(self):
-        return countries.query.filter_by(_id=self.team_2_id).first().name
-
-    def __init__(self, team_1_id, team_2_id, winner, is_played, match_date):
-        self.team_1_id = team_1_id
-        self.team_2_id = team_2_id
-        self.winner = winner
-        self.is_played = is_played
-        self.match_date = match_date
-
-
-class knockout_picks(db.Model):
-    _id = db.Column("id", db.Integer, primary_key=True)
-    knockout_match_id = db.Column(db.Integer)
-    user_id = db.Column(db.String(500))
-    winner = db.Column(db.Integer)
-
-    def __init__(self, knockout_match_id, user_id, winner):
-        self.knockout_match_id = knockout_match_id
-        self.user_id = user_id
-        self.winner = winner
-    # def __init__(self, knockout_match_id, user_id, winner):
-    #     self.knockout_match_id = knockout_match_id
-    #     self.winner = winner
-    #     self.user_id = user_id
-
-
-class countries(db.Model):
-    _id = db.Column("id", db.Integer, primary_key=True)
-    name = db.Column(db.String(500))
-    flag_name = db.Column(db.String(500))
-
-    def __init__(self, _id, name, flag_name):
-        self._id = _id
-        self.name = name
-        self.flag_name = flag_name
-
-
-class picks(db.Model):
-    _id = db.Column("id", db.Integer, primary_key=True)
-    user_id = db.Column(db.String(500))
-    group_id = db.Column(db.Integer)
-    first_seed_id = db.Column(db.Integer)
-    second_seed_id = db.Column(db.Integer)
-
-    def country(self, country_id):
-        return countries.query.filter_by(_id=country_id).first().name
-
-    def __init__(self, user_id, first_seed_id, second_seed_id, group_id):
-        self.user_id = user_id
-        self.first_seed_id = first_seed_id
-        self.second_seed_id = second_seed_id
-        self.group_id = group_id
-
-
-class matches(db.Model):
-    _id = db.Column("id", db.Integer, primary_key=True)
-    match_date = db.Column(db.Date)
-    team_1_id = db.Column(db.Integer)
-    team_2_id = db.Column(db.Integer)
-    team_1_goals = db.Column(db.Integer)
-    team_2_goals = db.Column(db.Integer)
-    is_played = db.Column(db.Boolean)
-
-    def get_winner(self):
-        if self.is_played:
-            if self.team_1_goals == self.team_2_goals:
-                return 'Draw'
-            elif self.team_1_goals > self.team_2_goals:
-                return self.team_1_id
-            elif self.team_2_goals > self.team_1_goals:
-                return self.team_2_id
-
-    def get_country(self, team_id):
-        return countries.query.filter_by(_id=team_id).first().name
-
-    def __init__(self, match_date, team_1_id, team_2_id, team_1_goals, team_2_goals):
-        self.match_date = match_date
-        self.team_1_id = team_1_id
-        self.team_2_id = team_2_id
-        self.team_1_goals = team_1_goals
-        self.team_2_goals = team_2_goals
-
-
-class groups(db.Model):
-    _id = db.Column("id", db.Integer, primary_key=True)
-    group_name = db.Column(db.String(500))
-    team_1_id = db.Column(db.Integer)
-    team_2_id = db.Column(db.Integer)
-    team_3_id = db.Column(db.Integer)
-    team_4_id = db.Column(db.Integer)
-    team_1_points = db.Column(db.Integer)
-    team_2_points = db.Column(db.Integer)
-    team_3_points = db.Column(db.Integer)
-    team_4_points = db.Column(db.Integer)
-
-    def get_played_by_team(self, team_id):
-        matches_played_1 = len(matches.query.filter_by(team_1_id=team_id, is_played=True).all())
-        matches_played_2 = len(matches.query.filter_by(team_2_id=team_id, is_played=True).all())
-        return matches_played_2 + matches_played_1
-
-    def get_points_by_team(self, team_id):
-        points = 0
-        matches_played_1 = matches.query.filter_by(team_1_id=team_id, is_played=True).all()
-        matches_played_2 = matches.query.filter_by(team_2_id=team_id, is_played=True).all()
-        matches_played = matches_played_1 + matches_played_2
-        for match in matches_played:
-            if match.get_winner() == 'Draw':
-                points = points + 1
-            elif match.get_winner() == team_id:
-                points = points + 3
-        return points
-
-    def user_picked(self, user_id, group_id):
-        user_picks = picks.query.filter_by(user_id=user_id, group_id=group_id).first()
-        if user_picks:
-            return True
+            planned.append((match, goals))
+    planned_knockout = []
+    for match_id, row in zip(knockout_ids, knockout_results):
+        match = knockout_by_id.get(match_id)
+        try:
+            winner = int(row['winner'])
+        except (KeyError, TypeError, ValueError):
+            errors.append(dict(knockout_match_id=match_id, error='winner is a required number'))
+            continue
+        if match is None:
+            errors.append(dict(knockout_match_id=match_id, error='unknown knockout match'))
+        elif knockout_ids.count(match_id) > 1:
+            errors.append(dict(knockout_match_id=match_id, error='knockout match appears more than once'))
+        elif winner not in (match.team_1_id, match.team_2_id):
+            errors.append(dict(knockout_match_id=match_id, error='winner must be one of the two teams'))
         else:
-            return None
-
-    def get_first_seed(self, user_id, group_id):
-        first_pick = picks.query.filter_by(user_id=user_id, group_id=group_id).first()
-        if first_pick:
-            return countries.query.filter_by(_id=first_pick.first_seed_id).first()
+            planned_knockout.append((match, winner))
+    if errors:
+        return errors, []
+
+    changes = []
+    group_ids = set()
+    changed_knockout_ids = set()
+    for match, (team_1_goals, team_2_goals) in planned:
+        old = (match.team_1_goals, match.team_2_goals) if match.is_played else None
+        if old == (team_1_goals, team_2_goals):
+            continue
+        group_ids.add(apply_match_result(match, team_1_goals, team_2_goals))
+        changes.append(dict(match_id=match._id, old=old, new=[team_1_goals, team_2_goals]))
+    for match, winner in planned_knockout:
+        old = match.winner if match.is_played else None
+        if old == winner:
+            continue
+        apply_knockout_winner(match, winner)
+        changed_knockout_ids.add(match._id)
+        changes.append(dict(knockout_match_id=match._id, old=old, new=winner))
+    db.session.commit()
+
+    if group_ids:
+        page_cache.bump(f'groups-{tournament_id}')
+    affected_users = {p.user_id for p in picks.query.filter(picks.group_id.in_(group_ids))} if group_ids else set()
+    if changed_knockout_ids:
+        affected_users |= {p.user_id for p in knockout_picks.query.filter(
+            knockout_picks.knockout_match_id.in_(changed_knockout_ids))}
+    scoring_jobs.enqueue(tournament_id, affected_users, 'result import')
+    return [], changes
+
+
+def started_group_ids(tournament_id):
+    return {item[0] for item in db.session.query(standings.group_id)
+            .filter(standings.tournament_id == tournament_id, standings.played > 0).distinct().all()}
+
+
+def save_group_picks(tournament_id, user_id, pick_list):
+    # validates every pick first and writes them all in one transaction, or nothing when any pick is invalid
+    group_by_id = {group._id: group for group in groups.query.filter_by(tournament_id=tournament_id).all()}
+    started = started_group_ids(tournament_id)
+    errors = []
+    values = []
+    for index, pick in enumerate(pick_list):
+        try:
+            group_id = int(pick['group_id'])
+            first_seed = int(pick['first_seed_id'])
+            second_seed = int(pick['second_seed_id'])
+        except (KeyError, TypeError, ValueError):
+            errors.append(dict(index=index, error='group_id, first_seed_id and second_seed_id are required numbers'))
+            continue
+        group = group_by_id.get(group_id)
+        if group is None:
+            errors.append(dict(index=index, error=f'unknown group {group_id}'))
+        elif first_seed == second_seed:
+            errors.append(dict(index=index, error='first and second seed must be different teams'))
+        elif first_seed not in group.team_ids() or second_seed not in group.team_ids():
+            errors.append(dict(index=index, error=f'seeds must be teams in group {group.group_name}'))
+        elif group_id in started:
+            errors.append(dict(index=index, error=f'group {group.group_name} has started, picks are locked'))
         else:
-            return None
-
-    def get_second_seed(self, user_id, group_id):
-        second_pick = picks.query.filter_by(user_id=user_id, group_id=group_id).first()
-        if second_pick:
-            return countries.query.filter_by(_id=second_pick.second_seed_id).first()
+            values.append(dict(user_id=user_id, group_id=group_id, first_seed_id=first_seed, second_seed_id=second_seed))
+    if errors:
+        return errors, []
+    for value in values:
+        upsert(picks, value, ['user_id', 'group_id'], ['first_seed_id', 'second_seed_id'])
+    db.session.commit()
+    if values:
+        scoring_jobs.enqueue(tournament_id, [user_id], 'group picks')
+    return [], values
+
+
+def save_knockout_picks(tournament_id, user_id, pick_list):
+    # same all-or-nothing rules as save_group_picks, a knockout pick is locked once made or on the match day
+    date_today = datetime.date(datetime.today())
+    match_ids = []
+    for pick in pick_list:
+        try:
+            match_ids.append(int(pick['knockout_match_id']))
+        except (KeyError, TypeError, ValueError):
+            pass
+    match_by_id = {match._id: match for match in knockout_matches.query.filter(
+        knockout_matches.tournament_id == tournament_id, knockout_matches._id.in_(match_ids))}
+    existing = {pick.knockout_match_id: pick.winner for pick in
+                knockout_picks.query.filter(knockout_picks.user_id == user_id,
+                                            knockout_picks.knockout_match_id.in_(match_ids))}
+    errors = []
+    values = []
+    for index, pick in enumerate(pick_list):
+        try:
+            match_id = int(pick['knockout_match_id'])
+            winner = int(pick['winner'])
+        except (KeyError, TypeError, ValueError):
+            errors.append(dict(index=index, error='knockout_match_id and winner are required numbers'))
+            continue
+        match = match_by_id.get(match_id)
+        if match is None:
+            errors.append(dict(index=index, error=f'unknown knockout match {match_id}'))
+        elif winner not in (match.team_1_id, match.team_2_id):
+            errors.append(dict(index=index, error='winner must be one of the two teams'))
+        elif match_id in existing:
+            if existing[match_id] != winner:
+                errors.append(dict(index=index, error='this match has already been picked'))
+        elif not match.match_date > date_today:
+            errors.append(dict(index=index, error='picks close the day before the match'))
         else:
-            return None
-
-    def get_country(self, team_id):
-        return countries.query.filter_by(_id=team_id).first().name
-
-    def get_flag(self, team_id):
-        return countries.query.filter_by(_id=team_id).first().name.lower()
-
-    def get_username_by_id(self, user_id):
-        return users.query.filter_by(_id=user_id).first().name
-
-    def __init__(self, group_name, team_1_id, team_2_id, team_3_id, team_4_id):
-        self.group_name = group_name
-        self.team_1_id = team_1_id
-        self.team_2_id = team_2_id
-        self.team_3_id = team_3_id
-        self.team_4_id = team_4_id
+            values.append(dict(knockout_match_id=match_id, user_id=user_id, winner=winner))
+    if errors:
+        return errors, []
+    for value in values:
+        upsert(knockout_picks, value, ['user_id', 'knockout_match_id'])
+    db.session.commit()
+    # no points change before the match is played, the run refreshes the pick analytics cached with the scoreboard
+    if values:
+        scoring_jobs.enqueue(tournament_id, [user_id], 'knockout picks')
+    return [], values
+
+
+# view models: plain dicts built with a fixed number of queries so templates never hit the database
+def country_names(country_list):
+    return [country.name if country else None for country in country_list]
+
+
+def group_views(tournament_id, user_id=None, with_standings=False):
+    group_list = groups.query.options(db.joinedload(groups.team_1), db.joinedload(groups.team_2),
+                                      db.joinedload(groups.team_3), db.joinedload(groups.team_4)) \
+        .filter_by(tournament_id=tournament_id).order_by(groups._id).all()
+    standing_by_team = {}
+    if with_standings:
+        standing_by_team = {standing.team_id: standing for standing in
+                            standings.query.filter_by(tournament_id=tournament_id).all()}
+    user_picks = {}
+    if user_id is not None:
+        pick_list = picks.query.options(db.joinedload(picks.first_seed), db.joinedload(picks.second_seed)) \
+            .filter(picks.user_id == user_id, picks.group_id.in_([group._id for group in group_list])) \
+            .order_by(picks._id).all()
+        for pick in pick_list:
+            user_picks.setdefault(pick.group_id, pick)
+    group_view_list = []
+    for group in group_list:
+        pick = user_picks.get(group._id)
+        teams = [(team_id, team) for team_id, team in zip(
+            [group.team_1_id, group.team_2_id, group.team_3_id, group.team_4_id],
+            [group.team_1, group.team_2, group.team_3, group.team_4]) if team_id is not None]
+        team_names = country_names([team for _, team in teams])
+        table = []
+        for (team_id, _), team_name in zip(teams, team_names):
+            standing = standing_by_team.get(team_id)
+            table.append(dict(
+                name=team_name,
+                played=standing.played if standing else 0,
+                goals_for=standing.goals_for if standing else 0,
+                goal_difference=standing.goal_difference if standing else 0,
+                points=standing.points if standing else 0,
+            ))
+        table.sort(key=lambda team: (team['points'], team['goal_difference'], team['goals_for']), reverse=True)
+        group_view_list.append(dict(
+            _id=group._id,
+            group_name=group.group_name,
+            team_ids=group.team_ids(),
+            teams=team_names,
+            table=table,
+            is_complete=sum(team['played'] for team in table) == scoring.complete_group_played(len(table)),
+            picked=pick is not None,
+            first_seed=pick.first_seed.name if pick and pick.first_seed else None,
+            second_seed=pick.second_seed.name if pick and pick.second_seed else None,
+        ))
+    return group_view_list
+
+
+def knockout_views(tournament_id, user_id=None):
+    match_list = knockout_matches.query.options(db.joinedload(knockout_matches.team_1),
+                                                db.joinedload(knockout_matches.team_2),
+                                                db.joinedload(knockout_matches.winner_country)) \
+        .filter_by(tournament_id=tournament_id).order_by(knockout_matches.match_date, knockout_matches._id).all()
+    user_picks = {}
+    if user_id is not None:
+        pick_list = knockout_picks.query.options(db.joinedload(knockout_picks.winner_country)) \
+            .filter(knockout_picks.user_id == user_id,
+                    knockout_picks.knockout_match_id.in_([match._id for match in match_list])) \
+            .order_by(knockout_picks._id).all()
+        for pick in pick_list:
+            user_picks.setdefault(pick.knockout_match_id, pick)
+    knockout_view_list = []
+    for match in match_list:
+        pick = user_picks.get(match._id)
+        team_1, team_2, winner = country_names([match.team_1, match.team_2, match.winner_country])
+        knockout_view_list.append(dict(
+            _id=match._id,
+            team_1_id=match.team_1_id,
+            team_2_id=match.team_2_id,
+            team_1=team_1,
+            team_2=team_2,
+            is_played=match.is_played,
+            winner=winner,
+            match_date=match.match_date,
+            picked=pick.winner_country.name if pick else None,
+        ))
+    return knockout_view_list
+
+
+def match_views(tournament_id):
+    match_list = matches.query.options(db.joinedload(matches.team_1), db.joinedload(matches.team_2)) \
+        .filter_by(tournament_id=tournament_id).order_by(matches.match_date, matches.is_played).all()
+    match_view_list = []
+    for match in match_list:
+        team_1, team_2 = country_names([match.team_1, match.team_2])
+        match_view_list.append(dict(
+            _id=match._id,
+            match_date=match.match_date,
+            team_1=team_1,
+            team_2=team_2,
+            team_1_goals=match.team_1_goals,
+            team_2_goals=match.team_2_goals,
+            is_played=match.is_played,
+        ))
+    return match_view_list
+
+
+# leaderboard reads go through ix_scores_leaderboard (tournament_id, total_points DESC, user_id): a page is a range
+# scan from a (total_points, user_id) cursor and a rank lookup is a primary key read, whatever the number of players
+def leaderboard_query(tournament_id):
+    # players without group points are left off the board and out of the ranking
+    return db.session.query(scores, users.name).join(users, users._id == scores.user_id) \
+        .filter(scores.tournament_id == tournament_id, scores.group_points > 0)
+
+
+def after_cursor(query, total_points, user_id):
+    return query.filter(db.or_(scores.total_points < total_points,
+                               db.and_(scores.total_points == total_points, scores.user_id > user_id)))
+
+
+def leaderboard_page(tournament_id, after=None, limit=50):
+    # (rows, cursor of the next page or None), after is the cursor returned with the previous page
+    query = leaderboard_query(tournament_id)
+    if after is not None:
+        query = after_cursor(query, *after)
+    rows = query.order_by(scores.total_points.desc(), scores.user_id).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = format_cursor(rows[-1][0])
+    return rows, next_cursor
+
+
+def leaderboard_around(tournament_id, user_id, count=5):
+    # (rows above, the user's row, rows below), the user's row is None when they are not on the leaderboard
+    me = leaderboard_query(tournament_id).filter(scores.user_id == user_id).first()
+    if me is None:
+        return [], None, []
+    score = me[0]
+    above = leaderboard_query(tournament_id).filter(
+        db.or_(scores.total_points > score.total_points,
+               db.and_(scores.total_points == score.total_points, scores.user_id < user_id))) \
+        .order_by(scores.total_points, scores.user_id.desc()).limit(count).all()
+    below = after_cursor(leaderboard_query(tournament_id), score.total_points, user_id) \
+        .order_by(scores.total_points.desc(), scores.user_id).limit(count).all()
+    return above[::-1], me, below
+
+
+def format_cursor(score):
+    return f'{score.total_points}:{score.user_id}'
+
+
+def parse_cursor(cursor):
+    total_points, _, user_id = cursor.partition(':')
+    return int(total_points), user_id
+
+
+def leaderboard_row(score, name):
+    return dict(user_id=score.user_id, name=name, group_points=score.group_points,
+                knockout_points=score.knockout_points, total_points=score.total_points, rank=score.rank)
+
+
+def render_scoreboard(tournament_id, pool_id=None):
+    # the first page of the leaderboard, or a whole pool ranked among its members
+    if pool_id is None:
+        score_list, next_cursor = leaderboard_page(tournament_id, limit=current_app.config['LEADERBOARD_PAGE_SIZE'])
+    else:
+        score_list = leaderboard_query(tournament_id) \
+            .join(pool_members, pool_members.user_id == scores.user_id).filter(pool_members.pool_id == pool_id) \
+            .order_by(scores.total_points.desc(), scores.user_id).all()
+        next_cursor = None
+    user_list_scores = []
+    rank = 0
+    previous_total = None
+    for position, (score, name) in enumerate(score_list, start=1):
+        if score.total_points != previous_total:
+            rank = position if pool_id is not None else score.rank
+            previous_total = score.total_points
+        user_tuple = (name, score.group_points, score.knockout_points, score.total_points, score.user_id, rank)
+        user_list_scores.append(user_tuple)
+    return render_template('_scoreboard.html', user_list_scores=user_list_scores, next_cursor=next_cursor)
+
+
+def live_snapshot(tournament_id):
+    # what the stream pushes: the scoreboard rows as rendered on / and the results entered so far
+    score_list = db.session.query(scores, users.name).join(users, users._id == scores.user_id) \
+        .filter(scores.tournament_id == tournament_id, scores.group_points > 0).all()
+    scoreboard = {score.user_id: [name, score.group_points, score.knockout_points, score.total_points, score.rank]
+                  for score, name in score_list}
+    played_matches = {}
+    for match in matches.query.filter_by(tournament_id=tournament_id, is_played=True).all():
+        played_matches[match._id] = [country_cache.name(match.team_1_id), match.team_1_goals, match.team_2_goals,
+                                     country_cache.name(match.team_2_id)]
+    knockout = {match._id: country_cache.name(match.winner) for match in knockout_matches.query.filter(
+        knockout_matches.tournament_id == tournament_id, knockout_matches.is_played == True).all()}
+    return dict(scoreboard=scoreboard, matches=played_matches, knockout=knockout)
+
+
+def live_version(tournament_id):
+    return page_cache.version(f'scoreboard-{tournament_id}'), page_cache.version(f'groups-{tournament_id}')
+
+
+def render_groups(tournament_id):
+    return render_template('_groups.html', group_list=group_views(tournament_id, with_standings=True))
+
+
+def render_pick_popularity(tournament_id):
+    frames = analytics.load_frames(tournament_id)
+    group_table, knockout_table = analytics.pick_distribution(frames)
+    group_rows = group_table.reset_index()
+    group_rows['team'] = group_rows['team_id'].map(country_cache.name)
+    knockout_rows = knockout_table.reset_index().rename(columns=dict(winner='team_id'))
+    knockout_rows['team'] = knockout_rows['team_id'].map(country_cache.name)
+    group_list = [dict(group_id=group_id, teams=rows.drop(columns='group_id').to_dict('records'))
+                  for group_id, rows in group_rows.groupby('group_id')]
+    match_list = [dict(knockout_match_id=match_id, winners=rows.drop(columns='knockout_match_id').to_dict('records'))
+                  for match_id, rows in knockout_rows.groupby('knockout_match_id')]
+    return json.dumps(dict(groups=group_list, knockout_matches=match_list), default=int)
+
+
+def render_max_points(tournament_id, limit):
+    table = analytics.max_points(analytics.load_frames(tournament_id))
+    leader = int(table['total_points'].max()) if len(table) else 0
+    table['can_win'] = table['max_total_points'] >= leader
+    rows = table.head(limit).reset_index()[['user_id', 'name', 'total_points', 'max_group_points',
+                                            'max_knockout_points', 'max_total_points', 'can_win']]
+    return json.dumps(dict(leader_points=leader, players=len(table), still_in_it=int(table['can_win'].sum()),
+                           rows=rows.to_dict('records')), default=int)
+
+
+def render_what_if(tournament_id, team_id, limit):
+    table = analytics.what_if(analytics.load_frames(tournament_id), team_id)
+    rows = table.head(limit).reset_index()[['user_id', 'name', 'total_points', 'projected_low', 'projected_high',
+                                            'projected_rank']]
+    return json.dumps(dict(team_id=team_id, team=country_cache.name(team_id), rows=rows.to_dict('records')),
+                      default=int)
+
+
+def user_pools(tournament_id, user_id):
+    return pools.query.join(pool_members, pool_members.pool_id == pools._id) \
+        .filter(pools.tournament_id == tournament_id, pool_members.user_id == user_id).order_by(pools._id).all()
 
 
-login_manager = LoginManager()
-login_manager.init_app(app)
 client = WebApplicationClient(GOOGLE_CLIENT_ID)
 
 
@@ -299,7 +662,7 @@ def load_user(user_id):
     return users.query.filter_by(_id=user_id).first()
 
 
-@app.route("/login/callback")
+@bp.route("/login/callback")
 def callback():
     code = request.args.get("code")
     google_provider_cfg = get_google_provider_cfg()
@@ -310,23 +673,25 @@ def callback():
         redirect_url=request.base_url,
         code=code
     )
-    token_response = requests.post(
+    token_response = http_session.post(
         token_url,
         headers=headers,
         data=body,
         auth=(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET),
+        timeout=oidc.TIMEOUT,
     )
 
     # Parse the tokens!
-    client.parse_request_body_response(json.dumps(token_response.json()))
+    client.parse_request_body_response(token_response.text)
     userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
     uri, headers, body = client.add_token(userinfo_endpoint)
-    userinfo_response = requests.get(uri, headers=headers, data=body)
+    userinfo_response = http_session.get(uri, headers=headers, data=body, timeout=oidc.TIMEOUT)
+    userinfo = userinfo_response.json()
 
-    if userinfo_response.json().get("email_verified"):
-        unique_id = userinfo_response.json()["sub"]
-        users_email = userinfo_response.json()["email"]
-        users_name = userinfo_response.json()["given_name"]
+    if userinfo.get("email_verified"):
+        unique_id = userinfo["sub"]
+        users_email = userinfo["email"]
+        users_name = userinfo["given_name"]
     else:
         return "User email not available or not verified by Google.", 400
 
@@ -339,10 +704,10 @@ def callback():
     login_user(user)
     session['name'] = users_name
     session['id'] = unique_id
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
-@app.route("/login")
+@bp.route("/login")
 def login():
     google_provider_cfg = get_google_provider_cfg()
     authorization_endpoint = google_provider_cfg["authorization_endpoint"]
@@ -351,127 +716,198 @@ def login():
     return redirect(request_uri)
 
 
-@app.route("/", methods=['POST', 'GET'])
+@bp.route("/", methods=['POST', 'GET'])
 def index():
     if current_user.is_authenticated:
         user_email = session['name']
-        user_picks_2 = len(knockout_picks.query.filter_by(user_id=session['id']).all())
-        available_matches = len(knockout_matches.query.all())
+        tournament_id = current_tournament_id()
+        user_picks_2 = knockout_picks.query.join(knockout_matches) \
+            .filter(knockout_picks.user_id == session['id'], knockout_matches.tournament_id == tournament_id).count()
 
-        user_list = users.query.filter_by().all()
-        user_picks = None
         selected_user = session['id']
-        if request.method == "POST":
+        if request.method == "POST" and request.form.get('user_dropdown'):
             selected_user = request.form['user_dropdown']
-            user_picks = picks.query.filter_by(user_id=selected_user).all()
-
-        knockout_match_list = knockout_matches.query.all()
-        knockout_list = []
-        for k in knockout_match_list:
-            picked = knockout_picks.query.filter_by(user_id=selected_user, knockout_match_id=k._id).first()
-            picked_country = "Not picked yet"
-            if picked:
-                picked_country = countries.query.filter_by(_id=picked.winner).first().name
-            k_tuple = (k, picked_country)
-            knockout_list.append(k_tuple)
-
-        user_list_scores = []
-        for item in user_list:
-            points = item.calc_points()
-            points_knockout = item.knockout_points()
-            points_total = points_knockout + points
-            if points:
-                user_tuple = (item.name, points, points_knockout, points_total)
-                user_list_scores.append(user_tuple)
-        user_list_scores.sort(key=lambda x: x[3], reverse=True)
-        knockout_list.sort(key=lambda x: x[0].match_date, reverse=False)
+        selected_user_name = session['name'] if selected_user == session['id'] else \
+            db.session.query(users.name).filter_by(_id=selected_user).scalar()
+
+        knockout_list = knockout_views(tournament_id, selected_user)
+        available_matches = len(knockout_list)
+
+        pool_list = user_pools(tournament_id, session['id'])
+        pool_id = request.args.get('pool', type=int)
+        if pool_id not in [pool._id for pool in pool_list]:
+            pool_id = None
+        scoreboard_html = page_cache.get_or_render(f'scoreboard-{tournament_id}',
+                                                   lambda: render_scoreboard(tournament_id, pool_id),
+                                                   key=f'scoreboard-{tournament_id}-{pool_id}')
+        above, me, below = leaderboard_around(tournament_id, session['id'], count=2) if pool_id is None \
+            else ([], None, [])
         return render_template('index.html', user_email=user_email, knockout_list=knockout_list,
-                               user_picks_2=user_picks_2, user_list=user_list, user_picks=user_picks,
-                               selected_user=selected_user, available_matches=available_matches,
-                               user_list_scores=user_list_scores)
+                               user_picks_2=user_picks_2, selected_user=selected_user,
+                               selected_user_name=selected_user_name, available_matches=available_matches,
+                               scoreboard_html=scoreboard_html,
+                               tournament_list=tournaments.query.order_by(tournaments._id).all(),
+                               tournament_id=tournament_id, pool_list=pool_list, pool_id=pool_id,
+                               around_me=above + [me] + below if me else [])
     else:
         return '<a class="button" href="/login">Google Login</a>'
 
 
-@app.route("/groups")
+@bp.route("/tournaments/<int:tournament_id>")
+def choose_tournament(tournament_id):
+    if current_user.is_authenticated:
+        if db.session.get(tournaments, tournament_id) is not None:
+            session['tournament_id'] = tournament_id
+        return redirect(url_for('main.index'))
+    else:
+        return '<a class="button" href="/login">Google Login</a>'
+
+
+@bp.route("/groups")
 def all_groups():
     if current_user.is_authenticated:
         user_email = session['name']
-        group_list = groups.query.all()
-        return render_template('groups.html', user_email=user_email, group_list=group_list)
+        tournament_id = current_tournament_id()
+        groups_html = page_cache.get_or_render(f'groups-{tournament_id}', lambda: render_groups(tournament_id))
+        return render_template('groups.html', user_email=user_email, groups_html=groups_html)
     else:
         return '<a class="button" href="/login">Google Login</a>'
 
 
-@app.route("/knockout_stage", methods=["POST", "GET"])
+@bp.route("/knockout_stage", methods=["POST", "GET"])
 def knockout_stage():
     if current_user.is_authenticated:
         user_email = session['name']
-        country_list = countries.query.all()
-        match_list = knockout_matches.query.all()
-
+        tournament_id = current_tournament_id()
+        country_list = country_cache.all()
         if request.method == "POST":
-            team_1_id = str(request.form['first_team'])
-            team_2_id = str(request.form['second_team'])
-            match_date = request.form['match_date']
-            winner = 0
-            new_match = knockout_matches(team_1_id, team_2_id, winner, False, match_date)
-            db.session.add(new_match)
-            db.session.commit()
+            if not is_admin():
+                return 'only admins can enter knockout matches', 403
+            if 'winner' in request.form:
+                # the same checks as an imported result: a known match of this tournament and one of its teams
+                result = dict(knockout_match_id=request.form.get('match_id'), winner=request.form.get('winner'))
+                errors, _ = import_results(tournament_id, [], [result])
+                if errors:
+                    return errors[0]['error'], 404 if errors[0]['error'] == 'unknown knockout match' else 400
+            else:
+                try:
+                    team_1_id = int(request.form['first_team'])
+                    team_2_id = int(request.form['second_team'])
+                    match_date = datetime.fromisoformat(request.form['match_date'].strip()).date()
+                except (KeyError, ValueError):
+                    return 'first_team and second_team are required numbers, match_date a date like 2022-12-18', 400
+                if country_cache.get(team_1_id) is None or country_cache.get(team_2_id) is None:
+                    return 'unknown team', 400
+                if team_1_id == team_2_id:
+                    return 'a team cannot play itself', 400
+                winner = None
+                new_match = knockout_matches(team_1_id, team_2_id, winner, False, match_date, tournament_id)
+                db.session.add(new_match)
+                db.session.commit()
+                page_cache.bump(f'scoreboard-{tournament_id}')
+        match_list = knockout_views(tournament_id)
         return render_template('knockout_stage.html', user_email=user_email, country_list=country_list,
-                               match_list=match_list)
+                               match_list=match_list, is_admin=is_admin())
     else:
         return '<a class="button" href="/login">Google Login</a>'
 
 
-@app.route("/knockout_pick", methods=["POST", "GET"])
+@bp.route("/knockout_pick", methods=["POST", "GET"])
 def knockout_pick():
     if current_user.is_authenticated:
         user_email = session['name']
-        country_list = countries.query.all()
+        country_list = country_cache.all()
         date_today = datetime.date(datetime.today())
-        match_list = knockout_matches.query.all()
         user_id = session['id']
+        tournament_id = current_tournament_id()
         if request.method == "POST":
-            match_id = int(request.form['match_id'])
-            winner = int(request.form['winner'])
-            idk = knockout_picks(match_id, user_id, winner)
-            db.session.add(idk)
-            db.session.commit()
+            save_knockout_picks(tournament_id, user_id, [dict(knockout_match_id=request.form['match_id'],
+                                                              winner=request.form['winner'])])
+        match_list = knockout_views(tournament_id, user_id)
         return render_template('knockout_pick.html', user_email=user_email, country_list=country_list,
                                match_list=match_list, date_today=date_today, user_id=user_id)
     else:
         return '<a class="button" href="/login">Google Login</a>'
 
 
-@app.route("/matches", methods=['POST', 'GET'])
+@bp.route("/matches", methods=['POST', 'GET'])
 def all_matches():
     if current_user.is_authenticated:
+        tournament_id = current_tournament_id()
         if request.method == "POST":
-            match_id = request.form['match_id']
-            team_1_goals = request.form['team_1_goals']
-            team_2_goals = request.form['team_2_goals']
-            selected_match = matches.query.filter_by(_id=match_id).first()
-            selected_match.is_played = True
-            selected_match.team_1_goals = team_1_goals
-            selected_match.team_2_goals = team_2_goals
-            db.session.commit()
+            if not is_admin():
+                return 'only admins can enter results', 403
+            result = dict(match_id=request.form.get('match_id'), team_1_goals=request.form.get('team_1_goals'),
+                          team_2_goals=request.form.get('team_2_goals'))
+            errors, _ = import_results(tournament_id, [result], [])
+            if errors:
+                return errors[0]['error'], 404 if errors[0]['error'] == 'unknown match' else 400
         user_email = session['name']
-        selected_user_id = users.query.filter_by(name=user_email).first()._id
-        match_list = matches.query.order_by(matches.match_date, matches.is_played).all()
+        selected_user_id = session['id']
+        match_list = match_views(tournament_id)
+        score_status = scoring_jobs.status() if is_admin() else None
         return render_template('matches.html', user_email=user_email, match_list=match_list,
-                               user_id=str(selected_user_id))
+                               user_id=str(selected_user_id), is_admin=is_admin(), score_status=score_status,
+                               tournament_id=tournament_id)
     else:
         return '<a class="button" href="/login">Google Login</a>'
 
 
-@app.route("/picks", methods=["POST", "GET"])
+@bp.route("/matches/import", methods=['POST'])
+def import_matches():
+    # a file of scores and knockout winners, see results_import.parse_results for the formats
+    if not current_user.is_authenticated or not is_admin():
+        return jsonify(error='admin login required'), 403
+    upload = request.files.get('results')
+    if upload is not None:
+        text, filename = upload.read().decode('utf-8-sig'), upload.filename or ''
+    else:
+        text, filename = request.get_data(as_text=True), ''
+    try:
+        match_results, knockout_results = parse_results(text, filename)
+    except ResultsImportError as error:
+        return jsonify(errors=[dict(error=str(error))]), 400
+    errors, changes = import_results(current_tournament_id(), match_results, knockout_results)
+    if errors:
+        return jsonify(errors=errors), 400
+    return jsonify(changed=len(changes), changes=changes)
+
+
+@bp.route("/stream")
+def stream():
+    # server-sent events with scoreboard and result changes, see live.py. Held connections are only cheap on a
+    # gevent worker, so other workers answer 204 and the browser stays on the page it loaded.
+    if not current_user.is_authenticated:
+        return '', 401
+    if not current_app.config['LIVE_STREAM']:
+        return '', 204
+    listener = live.subscribe(current_tournament_id())
+    return current_app.response_class(live.stream(listener), mimetype='text/event-stream',
+                                      headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@bp.route("/api/score_jobs")
+def api_score_jobs():
+    # queued and running score recomputations and when each tournament was last scored
+    if not current_user.is_authenticated:
+        return jsonify(error='login required'), 401
+    return jsonify(scoring_jobs.status())
+
+
+@bp.route("/cache_stats")
+def cache_stats():
+    if current_user.is_authenticated:
+        return dict(countries=country_cache.stats(), pages=page_cache.stats(), live=live.stats())
+    else:
+        return '<a class="button" href="/login">Google Login</a>'
+
+
+@bp.route("/picks", methods=["POST", "GET"])
 def all_picks():
     if current_user.is_authenticated:
         user_email = session['name']
         user_id = session['id']
-        group_list = groups.query.all()
-        pick_list = picks.query.filter_by(user_id=user_id).all()
+        tournament_id = current_tournament_id()
         if request.method == "POST":
             group_id = request.form['group_id']
             first_seed = request.form['first_seed']
@@ -481,19 +917,357 @@ def all_picks():
                     #first_seed_id = countries.query.filter_by(name=first_seed).first()._id
                     #second_seed_id = countries.query.filter_by(name=second_seed).first()._id
                     #if first_seed and second_seed:
-                    old_pick = picks.query.filter_by(user_id=user_id, group_id=group_id).first()
-                    if old_pick:
-                        old_pick.first_seed_id = first_seed
-                        old_pick.second_seed_id = second_seed
-                    else:
-                        new_pick = picks(first_seed_id=first_seed, second_seed_id=second_seed, user_id=user_id, group_id=group_id)
-                        db.session.add(new_pick)
-                    db.session.commit()
-        return render_template('your_pick.html', user_email=user_email, user_id=user_id, pick_list=pick_list, group_list=group_list)
+                    save_group_picks(tournament_id, user_id, [dict(group_id=group_id, first_seed_id=first_seed,
+                                                                   second_seed_id=second_seed)])
+        group_list = group_views(tournament_id, user_id)
+        return render_template('your_pick.html', user_email=user_email, user_id=user_id, group_list=group_list)
     else:
         return '<a class="button" href="/login">Google Login</a>'
 
 
-if __name__ == "__main__":
-    db.create_all()
-    app.run(ssl_context="adhoc")
+def posted_picks():
+    # the "picks" list of a JSON body, None unless the body is {"picks": [{...}, ...]}
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('picks'), list) or \
+            not all(isinstance(pick, dict) for pick in body['picks']):
+        return None
+    return body['picks']
+
+
+@bp.route("/api/picks", methods=["POST", "GET"])
+def api_picks():
+    # {"picks": [{"group_id": 1, "first_seed_id": 3, "second_seed_id": 4}, ...]}
+    if not current_user.is_authenticated:
+        return jsonify(error='login required'), 401
+    user_id = session['id']
+    tournament_id = current_tournament_id()
+    if request.method == "POST":
+        pick_list = posted_picks()
+        if pick_list is None:
+            return jsonify(errors=[dict(error='expected {"picks": [...]} with one object per pick')]), 400
+        errors, saved = save_group_picks(tournament_id, user_id, pick_list)
+        if errors:
+            return jsonify(errors=errors), 400
+        return jsonify(picks=saved)
+    pick_list = picks.query.join(groups).filter(picks.user_id == user_id, groups.tournament_id == tournament_id) \
+        .order_by(picks.group_id).all()
+    return jsonify(picks=[dict(group_id=pick.group_id, first_seed_id=pick.first_seed_id,
+                               second_seed_id=pick.second_seed_id) for pick in pick_list])
+
+
+@bp.route("/api/leaderboard")
+def api_leaderboard():
+    # ?after=<next from the previous page>&limit=50
+    if not current_user.is_authenticated:
+        return jsonify(error='login required'), 401
+    limit = min(max(request.args.get('limit', current_app.config['LEADERBOARD_PAGE_SIZE'], type=int), 1), 500)
+    after = request.args.get('after')
+    try:
+        after = parse_cursor(after) if after else None
+    except ValueError:
+        return jsonify(error='invalid cursor'), 400
+    rows, next_cursor = leaderboard_page(current_tournament_id(), after, limit)
+    return jsonify(rows=[leaderboard_row(score, name) for score, name in rows], next=next_cursor)
+
+
+@bp.route("/api/leaderboard/me")
+def api_leaderboard_me():
+    # the user's row with ?around=N players above and below, ?user_id= for someone else
+    if not current_user.is_authenticated:
+        return jsonify(error='login required'), 401
+    count = min(max(request.args.get('around', 5, type=int), 0), 50)
+    above, me, below = leaderboard_around(current_tournament_id(), request.args.get('user_id', session['id']), count)
+    if me is None:
+        return jsonify(error='not on the leaderboard of this tournament'), 404
+    return jsonify(me=leaderboard_row(*me), above=[leaderboard_row(score, name) for score, name in above],
+                   below=[leaderboard_row(score, name) for score, name in below])
+
+
+@bp.route("/api/leaderboard/snapshots")
+def api_leaderboard_snapshots():
+    # every recorded leaderboard of the tournament, the x axis of a rank chart
+    if not current_user.is_authenticated:
+        return jsonify(error='login required'), 401
+    return jsonify(snapshots=[dict(snapshot_id=snapshot_id, taken_at=taken_at.isoformat(),
+                                   matches_played=matches_played, players=players)
+                              for snapshot_id, taken_at, matches_played, players
+                              in snapshots.snapshot_list(current_tournament_id())])
+
+
+@bp.route("/api/leaderboard/history")
+def api_leaderboard_history():
+    # the player's points and rank in every snapshot, ?user_id= for someone else
+    if not current_user.is_authenticated:
+        return jsonify(error='login required'), 401
+    user_id = request.args.get('user_id', session['id'])
+    return jsonify(user_id=user_id, name=db.session.query(users.name).filter_by(_id=user_id).scalar(),
+                   history=[dict(snapshot_id=snapshot._id, taken_at=snapshot.taken_at.isoformat(),
+                                 matches_played=snapshot.matches_played, total_points=total_points, rank=rank)
+                            for snapshot, total_points, rank in snapshots.history(current_tournament_id(), user_id)])
+
+
+@bp.route("/api/leaderboard/movers")
+def api_leaderboard_movers():
+    # ?limit=10 biggest climbers and fallers since the previous snapshot, ?before=&after= snapshot ids for any two
+    if not current_user.is_authenticated:
+        return jsonify(error='login required'), 401
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    moved = snapshots.movers(current_tournament_id(), request.args.get('before', type=int),
+                             request.args.get('after', type=int), limit)
+    if moved is None:
+        return jsonify(error='needs two leaderboard snapshots'), 404
+    before, after, risers, fallers = moved
+    names = dict(db.session.query(users._id, users.name).filter(
+        users._id.in_([user_id for user_id, *_ in risers + fallers])).all())
+
+    def mover_rows(mover_list):
+        return [dict(user_id=user_id, name=names.get(user_id), rank_before=rank_before, rank_after=rank_after,
+                     change=rank_before - rank_after, points_gained=points_gained)
+                for user_id, rank_before, rank_after, points_gained in mover_list]
+
+    return jsonify(before=dict(snapshot_id=before._id, taken_at=before.taken_at.isoformat(),
+                               matches_played=before.matches_played),
+                   after=dict(snapshot_id=after._id, taken_at=after.taken_at.isoformat(),
+                              matches_played=after.matches_played),
+                   risers=mover_rows(risers), fallers=mover_rows(fallers))
+
+
+@bp.route("/api/users")
+def api_users():
+    # ?q= part of a name, for the player picker on the home page
+    if not current_user.is_authenticated:
+        return jsonify(error='login required'), 401
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify(users=[])
+    pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    user_list = db.session.query(users._id, users.name).filter(users.name.ilike(pattern, escape='\\')) \
+        .order_by(users.name, users._id).limit(20).all()
+    return jsonify(users=[dict(user_id=user_id, name=name) for user_id, name in user_list])
+
+
+@bp.route("/api/analytics/picks")
+def api_pick_popularity():
+    # how the players picked every group and knockout match
+    if not current_user.is_authenticated:
+        return jsonify(error='login required'), 401
+    tournament_id = current_tournament_id()
+    body = page_cache.get_or_render(f'scoreboard-{tournament_id}', lambda: render_pick_popularity(tournament_id),
+                                    key=f'analytics-picks-{tournament_id}')
+    return current_app.response_class(body, mimetype='application/json')
+
+
+@bp.route("/api/analytics/max_points")
+def api_max_points():
+    # ?limit=50 the players with the most points still within reach
+    if not current_user.is_authenticated:
+        return jsonify(error='login required'), 401
+    tournament_id = current_tournament_id()
+    limit = min(max(request.args.get('limit', current_app.config['LEADERBOARD_PAGE_SIZE'], type=int), 1), 500)
+    # knockout matches can be picked until their day, so the numbers also move with the date
+    body = page_cache.get_or_render(f'scoreboard-{tournament_id}', lambda: render_max_points(tournament_id, limit),
+                                    key=f'analytics-max-{tournament_id}-{limit}-{datetime.today().date()}')
+    return current_app.response_class(body, mimetype='application/json')
+
+
+@bp.route("/api/analytics/what_if")
+def api_what_if():
+    # ?team_id=3&limit=50 the leaderboard if that team wins every match it has left
+    if not current_user.is_authenticated:
+        return jsonify(error='login required'), 401
+    tournament_id = current_tournament_id()
+    team_id = request.args.get('team_id', type=int)
+    if team_id is None:
+        return jsonify(error='team_id required'), 400
+    if not any(team_id in group.team_ids() for group in groups.query.filter_by(tournament_id=tournament_id)):
+        return jsonify(error=f'unknown team {team_id}'), 404
+    limit = min(max(request.args.get('limit', current_app.config['LEADERBOARD_PAGE_SIZE'], type=int), 1), 500)
+    body = page_cache.get_or_render(f'scoreboard-{tournament_id}',
+                                    lambda: render_what_if(tournament_id, team_id, limit),
+                                    key=f'analytics-what-if-{tournament_id}-{team_id}-{limit}')
+    return current_app.response_class(body, mimetype='application/json')
+
+
+@bp.route("/api/knockout_picks", methods=["POST", "GET"])
+def api_knockout_picks():
+    # {"picks": [{"knockout_match_id": 1, "winner": 3}, ...]}
+    if not current_user.is_authenticated:
+        return jsonify(error='login required'), 401
+    user_id = session['id']
+    tournament_id = current_tournament_id()
+    if request.method == "POST":
+        pick_list = posted_picks()
+        if pick_list is None:
+            return jsonify(errors=[dict(error='expected {"picks": [...]} with one object per pick')]), 400
+        errors, saved = save_knockout_picks(tournament_id, user_id, pick_list)
+        if errors:
+            return jsonify(errors=errors), 400
+        return jsonify(picks=saved)
+    pick_list = knockout_picks.query.join(knockout_matches) \
+        .filter(knockout_picks.user_id == user_id, knockout_matches.tournament_id == tournament_id) \
+        .order_by(knockout_picks.knockout_match_id).all()
+    return jsonify(picks=[dict(knockout_match_id=pick.knockout_match_id, winner=pick.winner) for pick in pick_list])
+
+
+tournament_option = click.option("--tournament", "tournament_id", type=int,
+                                 help="tournament id, DEFAULT_TOURNAMENT_ID when not given")
+
+
+@bp.cli.command("import-results")
+@click.argument("results_file", type=click.File(encoding="utf-8-sig"))
+@tournament_option
+def import_results_command(results_file, tournament_id):
+    try:
+        match_results, knockout_results = parse_results(results_file.read(), results_file.name)
+    except ResultsImportError as error:
+        raise click.ClickException(str(error))
+    errors, changes = import_results(tournament_id or current_app.config['DEFAULT_TOURNAMENT_ID'],
+                                     match_results, knockout_results)
+    scoring_jobs.run_pending()
+    for error in errors:
+        print(f'error: {error}')
+    if errors:
+        raise SystemExit(1)
+    for change in changes:
+        print(f'changed: {change}')
+    print(f'{len(changes)} results changed')
+
+
+@bp.cli.command("rebuild-scores")
+@click.option("--tournament", "tournament_id", type=int, help="tournament id, all tournaments when not given")
+def rebuild_scores(tournament_id):
+    for item in [tournament_id] if tournament_id else tournament_ids():
+        update_scores(item)
+
+
+@bp.cli.command("score-worker")
+@click.option("--once", is_flag=True, help="score what is queued and exit")
+def score_worker(once):
+    # for SCORE_WORKER=external, one of these per deployment is enough but more can run side by side
+    if once:
+        print(f'{scoring_jobs.run_pending()} runs')
+    else:
+        scoring_jobs.run_forever()
+
+
+@bp.cli.command("rebuild-standings")
+@click.option("--tournament", "tournament_id", type=int, help="tournament id, all tournaments when not given")
+def rebuild_standings_command(tournament_id):
+    for item in [tournament_id] if tournament_id else tournament_ids():
+        rebuild_standings(item)
+
+
+@bp.cli.command("migrate")
+def migrate_command():
+    applied = migrations.migrate()
+    for version, name in applied:
+        print(f'applied {version}: {name}')
+    if not applied:
+        print('schema is up to date')
+        return
+    # standings and scores are derived, refill them in case a migration recreated them
+    for tournament_id in tournament_ids():
+        rebuild_standings(tournament_id)
+        update_scores(tournament_id)
+
+
+@bp.cli.command("create-tournament")
+@click.argument("name")
+def create_tournament(name):
+    tournament = tournaments(name)
+    db.session.add(tournament)
+    db.session.commit()
+    print(f'tournament {tournament._id}: {name}')
+
+
+@bp.cli.command("add-stage")
+@click.argument("tournament_id", type=int)
+@click.argument("name")
+@click.option("--start", type=click.DateTime(formats=["%Y-%m-%d"]), help="first match day, open when not given")
+@click.option("--end", type=click.DateTime(formats=["%Y-%m-%d"]), help="last match day, open when not given")
+@click.option("--points", type=int, default=1, show_default=True, help="points for a correct knockout pick")
+def add_stage(tournament_id, name, start, end, points):
+    db.session.add(stages(tournament_id, name, start.date() if start else None, end.date() if end else None, points))
+    db.session.commit()
+    update_scores(tournament_id)
+
+
+@bp.cli.command("create-pool")
+@click.argument("tournament_id", type=int)
+@click.argument("name")
+def create_pool(tournament_id, name):
+    pool = pools(tournament_id, name)
+    db.session.add(pool)
+    db.session.commit()
+    print(f'pool {pool._id}: {name}')
+
+
+@bp.cli.command("add-pool-member")
+@click.argument("pool_id", type=int)
+@click.argument("user_ids", nargs=-1, required=True)
+def add_pool_member(pool_id, user_ids):
+    pool = db.session.get(pools, pool_id)
+    if pool is None:
+        raise click.ClickException(f'unknown pool {pool_id}')
+    for user_id in user_ids:
+        upsert(pool_members, dict(pool_id=pool_id, user_id=user_id), ['pool_id', 'user_id'])
+    db.session.commit()
+    page_cache.bump(f'scoreboard-{pool.tournament_id}')
+
+
+@bp.cli.command("build-assets")
+def build_assets():
+    # run on deploy, before the workers start
+    templates = os.path.join(current_app.root_path, current_app.template_folder)
+    sources = [os.path.join(current_app.root_path, 'app.py')] + [os.path.join(templates, name)
+                                                                 for name in sorted(os.listdir(templates))]
+    for name, target, sizes in assets.build(current_app.static_folder, current_app.config['ASSETS_DIR'], sources):
+        print(f'{name} -> {target}  ' + '  '.join(f'{kind} {size / 1024:.1f} kB' for kind, size in sizes.items()))
+    asset_manifest.load()
+
+
+@bp.cli.command("check-indexes")
+def check_indexes():
+    # EXPLAIN the hot lookups, run it on a seeded database so the planner has a reason to use the indexes
+    results = migrations.explain_hot_paths()
+    for name, plan, uses_index in results:
+        print(f"{'ok' if uses_index else 'NO INDEX'}: {name}")
+        print('    ' + plan.replace('\n', '\n    '))
+    if not all(uses_index for _, _, uses_index in results):
+        raise SystemExit(1)
+
+
+@bp.cli.command("check-scoring")
+@tournament_option
+def check_scoring(tournament_id):
+    # compares the bulk scoring engine with the per-user methods, which only know the World Cup 2022 rules and
+    # read every group in the database
+    if len(tournament_ids()) > 1:
+        raise click.ClickException('the per-user methods can only check a database with a single tournament')
+    all_points = calc_all_points(tournament_id or current_app.config['DEFAULT_TOURNAMENT_ID'])
+    mismatches = 0
+    user_list = users.query.all()
+    for item in user_list:
+        expected = (item.calc_points(), item.knockout_points())
+        if all_points.get(item._id, (0, 0)) != expected:
+            mismatches += 1
+            print(f'{item._id}: engine {all_points.get(item._id, (0, 0))} != {expected}')
+    print(f'{len(user_list)} users checked, {mismatches} mismatches')
+    if mismatches:
+        raise SystemExit(1)
+
+
+def create_app(test_config=None):
+    app = Flask(__name__)
+    test_config = test_config or {}
+    app.config.from_mapping(settings(uri=test_config.get('SQLALCHEMY_DATABASE_URI')))
+    app.config.update(test_config)
+    db.init_app(app)
+    query_stats.init_app(app, allowed=is_admin)
+    page_cache.init_app(app)
+    live.init_app(app, snapshot=live_snapshot, version=live_version)
+    scoring_jobs.init_app(app, recompute=recompute_scores)
+    asset_manifest.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    return app
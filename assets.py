@@ -0,0 +1,238 @@
+# Static files for production. 'flask build-assets' copies static/ into static/dist/ with a content hash in every
+# name, drops the Bootstrap rules no template uses and writes gzip (and brotli, when the brotli package is installed)
+# copies next to the text files. asset_url() in the templates points at the hashed name from manifest.json, which
+# never changes content, so browsers keep it for a year without revalidating. Without a build it falls back to
+# /static/ as before.
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from types import SimpleNamespace
+
+from flask import current_app, request, send_from_directory, url_for, abort
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSED_TYPES = ('.css', '.js', '.svg', '.json', '.txt', '.html')
+# classes only Bootstrap's JavaScript adds, nothing in the templates mentions them
+SAFELIST = {'show', 'showing', 'hide', 'collapsing', 'collapsed', 'fade', 'active', 'disabled', 'modal-open',
+            'modal-backdrop', 'dropdown-menu-end', 'tooltip', 'popover'}
+TOKEN = re.compile(r'[A-Za-z0-9_-]+')
+CLASS = re.compile(r'\.(-?[_a-zA-Z][\w-]*)')
+# :not(), :is(), :where() and attribute selectors say nothing about which classes an element needs
+IGNORED_SELECTOR_PARTS = re.compile(r'\[[^\]]*\]|:[\w-]+\((?:[^()]|\([^()]*\))*\)')
+
+
+def used_tokens(paths):
+    # every word that could be a class name in the templates and the code that builds HTML
+    tokens = set(SAFELIST)
+    for path in paths:
+        with open(path, encoding='utf-8') as source:
+            tokens.update(TOKEN.findall(source.read()))
+    return tokens
+
+
+def split_rules(css):
+    # [(prelude, body), ...] of the top level, body None for statements such as @import, prelude None for the
+    # /*! license comments, which are kept. Other comments are dropped.
+    rules = []
+    depth = parens = 0
+    start = 0
+    prelude_end = None
+    quote = None
+    index = 0
+    while index < len(css):
+        char = css[index]
+        if quote:
+            if char == '\\':
+                index += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif css.startswith('/*', index):
+            end = css.find('*/', index + 2)
+            end = len(css) if end == -1 else end + 2
+            if depth == 0:
+                if css.startswith('/*!', index):
+                    rules.append((None, css[index:end]))
+                start = end
+            index = end
+            continue
+        elif char == '(':
+            parens += 1
+        elif char == ')':
+            parens -= 1
+        elif char == '{':
+            if depth == 0:
+                prelude_end = index
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                rules.append((css[start:prelude_end].strip(), css[prelude_end + 1:index]))
+                start = index + 1
+        elif char == ';' and depth == 0 and parens == 0:
+            rules.append((css[start:index].strip(), None))
+            start = index + 1
+        index += 1
+    return rules
+
+
+def split_selectors(prelude):
+    selectors = []
+    parens = 0
+    start = 0
+    for index, char in enumerate(prelude):
+        if char == '(':
+            parens += 1
+        elif char == ')':
+            parens -= 1
+        elif char == ',' and parens == 0:
+            selectors.append(prelude[start:index])
+            start = index + 1
+    selectors.append(prelude[start:])
+    return [selector.strip() for selector in selectors]
+
+
+def selector_used(selector, tokens):
+    return all(name in tokens for name in CLASS.findall(IGNORED_SELECTOR_PARTS.sub('', selector)))
+
+
+def strip_css(css, tokens):
+    # css without the selectors that need a class outside tokens, and without rules and @media blocks left empty
+    kept = []
+    for prelude, body in split_rules(css):
+        if prelude is None:
+            kept.append(body)
+        elif body is None:
+            kept.append(prelude + ';')
+        elif prelude.startswith(('@media', '@supports', '@layer', '@container')):
+            inner = strip_css(body, tokens)
+            if inner:
+                kept.append(prelude + '{' + inner + '}')
+        elif prelude.startswith('@'):
+            kept.append(prelude + '{' + body + '}')
+        else:
+            selectors = [selector for selector in split_selectors(prelude) if selector_used(selector, tokens)]
+            if selectors:
+                kept.append(','.join(selectors) + '{' + body + '}')
+    return ''.join(kept)
+
+
+def hashed_name(name, content):
+    stem, extension = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+
+
+def build(static_folder, output_folder, sources):
+    # writes the hashed and compressed files and manifest.json, returns [(name, hashed name, sizes), ...] where
+    # sizes maps original, built, gzip and br to bytes. Files of earlier builds stay, pages rendered by workers that
+    # still have the old manifest keep loading.
+    tokens = used_tokens(sources)
+    manifest = {}
+    report = []
+    for directory, directory_names, file_names in os.walk(static_folder):
+        directory_names[:] = [name for name in directory_names
+                              if os.path.abspath(os.path.join(directory, name)) != os.path.abspath(output_folder)]
+        for file_name in sorted(file_names):
+            path = os.path.join(directory, file_name)
+            name = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as static_file:
+                original = static_file.read()
+            content = original
+            if name.endswith('.css'):
+                content = strip_css(original.decode('utf-8'), tokens).encode('utf-8')
+            target = hashed_name(name, content)
+            target_path = os.path.join(output_folder, target)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            with open(target_path, 'wb') as built_file:
+                built_file.write(content)
+            sizes = dict(original=len(original), built=len(content))
+            if name.endswith(COMPRESSED_TYPES):
+                # mtime 0 keeps the gzip bytes the same from build to build
+                compressed = dict(gz=gzip.compress(content, 9, mtime=0))
+                if brotli is not None:
+                    compressed['br'] = brotli.compress(content, quality=11)
+                for suffix, data in compressed.items():
+                    with open(f'{target_path}.{suffix}', 'wb') as compressed_file:
+                        compressed_file.write(data)
+                    sizes['gzip' if suffix == 'gz' else suffix] = len(data)
+            manifest[name] = target
+            report.append((name, target, sizes))
+    os.makedirs(output_folder, exist_ok=True)
+    temporary_path = os.path.join(output_folder, f'manifest.json.{os.getpid()}')
+    with open(temporary_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(temporary_path, os.path.join(output_folder, 'manifest.json'))
+    return report
+
+
+class AssetManifest:
+    # asset_url() for the templates and the /assets/ route that serves the built files. The manifest belongs to the
+    # app in app.extensions, one instance serves every app built by create_app().
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_DIR', os.path.join(app.static_folder, 'dist'))
+        app.config.setdefault('ASSETS_MAX_AGE', 365 * 24 * 3600)
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.serve)
+        app.jinja_env.globals['asset_url'] = self.url
+        app.extensions['asset_manifest'] = SimpleNamespace(manifest={}, encodings={})
+        self.load(app)
+
+    @property
+    def state(self):
+        return current_app.extensions['asset_manifest']
+
+    def load(self, app=None):
+        app = app or current_app
+        directory = app.config['ASSETS_DIR']
+        state = app.extensions['asset_manifest']
+        try:
+            with open(os.path.join(directory, 'manifest.json')) as manifest_file:
+                manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            manifest = {}
+        state.encodings = {target: [(encoding, suffix) for encoding, suffix in (('br', '.br'), ('gzip', '.gz'))
+                                    if os.path.exists(os.path.join(directory, target + suffix))]
+                           for target in manifest.values()}
+        state.manifest = manifest
+
+    def url(self, filename):
+        manifest = self.state.manifest
+        if filename in manifest:
+            return url_for('assets', filename=manifest[filename])
+        return url_for('static', filename=filename)
+
+    def serve(self, filename):
+        # only names from the manifest, their content never changes so they can be cached for good
+        encodings = self.state.encodings
+        if filename not in encodings:
+            abort(404)
+        directory = current_app.config['ASSETS_DIR']
+        max_age = current_app.config['ASSETS_MAX_AGE']
+        suffix = ''
+        encoding = None
+        for candidate, candidate_suffix in encodings[filename]:
+            if candidate in request.accept_encodings:
+                encoding, suffix = candidate, candidate_suffix
+                break
+        response = send_from_directory(directory, filename + suffix, max_age=max_age,
+                                       mimetype=mimetypes.guess_type(filename)[0])
+        response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+        # send_file names the .gz or .br file here, the browser should only see the asset
+        response.headers.pop('Content-Disposition', None)
+        if encodings[filename]:
+            response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,324 @@
+# Benchmark for the main routes against a generated tournament.
+#
+#   python bench.py --users 10 100 1000 10000
+#   python bench.py --database postgresql://localhost/pwj_bench --users 100 --requests 50
+#   python bench.py --analytics --users 100 1000 10000
+#
+# Uses a throwaway SQLite file unless --database is given. Every table in that database is dropped and recreated.
+# --analytics times analytics.py against the per-player loops below instead of the routes and checks they agree.
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from flask import current_app
+
+import scoring
+
+ROUTES = ['/', '/picks', '/matches', '/knockout_pick', '/groups', '/api/leaderboard', '/api/leaderboard/me',
+          '/api/analytics/picks']
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def generate_tournament(world_cup, user_count, seed=2022, knockout_start=None):
+    # knockout_start is the first knockout match day, 8 days ago by default, 16 daily matches from there
+    db = world_cup.db
+    rnd = random.Random(seed)
+    today = date.today()
+    db.drop_all()
+    db.create_all()
+
+    import migrations
+    from models import countries
+    with db.engine.begin() as connection:
+        tournament_id = migrations.seed_world_cup_2022(connection)
+
+    db.session.execute(db.insert(countries), [
+        dict(_id=country_id, name=f'Country {country_id}', flag_name=f'flag_{country_id}')
+        for country_id in range(1, 33)
+    ])
+    match_rows = []
+    group_rows = []
+    for group_index in range(8):
+        teams = [group_index * 4 + position + 1 for position in range(4)]
+        points = dict.fromkeys(teams, 0)
+        # the first six groups are complete, the last two are halfway through
+        played_count = 6 if group_index < 6 else 3
+        for match_index, (team_1, team_2) in enumerate([(0, 1), (2, 3), (0, 2), (1, 3), (0, 3), (1, 2)]):
+            is_played = match_index < played_count
+            goals_1, goals_2 = (rnd.randint(0, 4), rnd.randint(0, 4)) if is_played else (None, None)
+            if is_played:
+                if goals_1 == goals_2:
+                    points[teams[team_1]] += 1
+                    points[teams[team_2]] += 1
+                elif goals_1 > goals_2:
+                    points[teams[team_1]] += 3
+                else:
+                    points[teams[team_2]] += 3
+            match_rows.append(dict(tournament_id=tournament_id, match_date=today - timedelta(days=20 - match_index),
+                                   team_1_id=teams[team_1], team_2_id=teams[team_2], team_1_goals=goals_1,
+                                   team_2_goals=goals_2, is_played=is_played))
+        group_rows.append(dict(tournament_id=tournament_id, group_name=chr(ord('A') + group_index),
+                               team_1_id=teams[0], team_2_id=teams[1], team_3_id=teams[2], team_4_id=teams[3],
+                               team_1_points=points[teams[0]],
+                               team_2_points=points[teams[1]], team_3_points=points[teams[2]],
+                               team_4_points=points[teams[3]]))
+    db.session.execute(db.insert(world_cup.groups), group_rows)
+    db.session.execute(db.insert(world_cup.matches), match_rows)
+
+    knockout_rows = []
+    for match_index in range(16):
+        team_1, team_2 = match_index * 2 + 1, match_index * 2 + 2
+        match_date = (knockout_start or today - timedelta(days=8)) + timedelta(days=match_index)
+        is_played = match_date < today
+        knockout_rows.append(dict(tournament_id=tournament_id, team_1_id=team_1, team_2_id=team_2,
+                                  match_date=match_date, is_played=is_played,
+                                  winner=rnd.choice([team_1, team_2]) if is_played else None))
+    db.session.execute(db.insert(world_cup.knockout_matches), knockout_rows)
+    db.session.commit()
+
+    group_list = world_cup.groups.query.order_by(world_cup.groups._id).all()
+    knockout_list = world_cup.knockout_matches.query.order_by(world_cup.knockout_matches._id).all()
+    for first_user in range(0, user_count, 1000):
+        user_rows, pick_rows, knockout_pick_rows = [], [], []
+        for user_index in range(first_user, min(user_count, first_user + 1000)):
+            user_id = str(100000000000 + user_index)
+            user_rows.append(dict(_id=user_id, email=f'user{user_index}@example.com', name=f'User {user_index}'))
+            for group in group_list:
+                first_seed, second_seed = rnd.sample([group.team_1_id, group.team_2_id, group.team_3_id,
+                                                      group.team_4_id], 2)
+                pick_rows.append(dict(user_id=user_id, group_id=group._id, first_seed_id=first_seed,
+                                      second_seed_id=second_seed))
+            for match in knockout_list:
+                knockout_pick_rows.append(dict(knockout_match_id=match._id, user_id=user_id,
+                                               winner=rnd.choice([match.team_1_id, match.team_2_id])))
+        db.session.execute(db.insert(world_cup.users), user_rows)
+        db.session.execute(db.insert(world_cup.picks), pick_rows)
+        db.session.execute(db.insert(world_cup.knockout_picks), knockout_pick_rows)
+        db.session.commit()
+    world_cup.rebuild_standings(tournament_id)
+    world_cup.update_scores(tournament_id)
+
+
+def login(client, user_id, name):
+    # skips the Google flow by writing what callback() would have put in the session
+    with client.session_transaction() as session:
+        session['_user_id'] = user_id
+        session['_fresh'] = True
+        session['id'] = user_id
+        session['name'] = name
+
+
+def run_route(client, route, request_count):
+    latencies = []
+    queries = []
+    for _ in range(request_count):
+        started = time.perf_counter()
+        response = client.get(route)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise SystemExit(f'{route} returned {response.status_code}')
+        queries.append(int(response.headers.get('X-Query-Count', 0)))
+    return dict(
+        requests=request_count,
+        p50_ms=percentile(latencies, 0.5),
+        p90_ms=percentile(latencies, 0.9),
+        p99_ms=percentile(latencies, 0.99),
+        max_ms=max(latencies),
+        queries=statistics.mean(queries),
+    )
+
+
+def naive_outcomes(team_ids, points, remaining, forced_winner=None):
+    # the (first seed, second seed) of every way the remaining matches can go, one scenario at a time
+    for outcome in itertools.product((3, 1, 0), repeat=len(remaining)):
+        final = dict(points)
+        possible = True
+        for (team_1, team_2), team_1_points in zip(remaining, outcome):
+            team_2_points = 1 if team_1_points == 1 else 3 - team_1_points
+            if (forced_winner == team_1 and team_1_points != 3) or (forced_winner == team_2 and team_2_points != 3):
+                possible = False
+            final[team_1] += team_1_points
+            final[team_2] += team_2_points
+        if possible:
+            yield scoring.group_seeds([(team_id, final[team_id]) for team_id in team_ids])
+
+
+def naive_groups(world_cup, tournament_id):
+    # (group_id, team_ids, points, remaining, started, complete schedule) per group
+    group_states = []
+    for group in world_cup.groups.query.filter_by(tournament_id=tournament_id).order_by(world_cup.groups._id):
+        team_ids = group.team_ids()
+        group_matches = world_cup.matches.query.filter(world_cup.matches.tournament_id == tournament_id,
+                                                       world_cup.matches.team_1_id.in_(team_ids)).all()
+        points = dict.fromkeys(team_ids, 0)
+        for match in group_matches:
+            if match.is_played:
+                for team_id, result in zip((match.team_1_id, match.team_2_id),
+                                           scoring.match_result(match.team_1_goals, match.team_2_goals)):
+                    points[team_id] += result[-1]
+        remaining = [(match.team_1_id, match.team_2_id) for match in group_matches if not match.is_played]
+        group_states.append((group._id, team_ids, points, remaining, len(remaining) < len(group_matches),
+                             2 * len(group_matches) == scoring.complete_group_played(len(team_ids))))
+    return group_states
+
+
+def naive_max_points(world_cup, tournament_id, today):
+    # analytics.max_points written the straightforward way: queries and scenario loops per player
+    group_states = naive_groups(world_cup, tournament_id)
+    stage_list = [(stage.start_date, stage.end_date, stage.points)
+                  for stage in world_cup.stages.query.filter_by(tournament_id=tournament_id)
+                  .order_by(world_cup.stages._id)]
+    knockout_list = world_cup.knockout_matches.query.filter_by(tournament_id=tournament_id).all()
+    results = {}
+    for score in world_cup.scores.query.filter_by(tournament_id=tournament_id).all():
+        user_picks = {}
+        for pick in world_cup.picks.query.filter_by(user_id=score.user_id).order_by(world_cup.picks._id):
+            user_picks.setdefault(pick.group_id, (pick.first_seed_id, pick.second_seed_id))
+        group_max = 0
+        can_score = bool(group_states)
+        for group_id, team_ids, points, remaining, started, complete_schedule in group_states:
+            if group_id not in user_picks:
+                if started:
+                    can_score = False
+                group_max += 3
+            elif complete_schedule:
+                group_max += max(scoring.pick_points(*user_picks[group_id], *seeds)
+                                 for seeds in naive_outcomes(team_ids, points, remaining))
+        knockout_max = score.knockout_points
+        for match in knockout_list:
+            if not match.is_played:
+                pick = world_cup.knockout_picks.query.filter_by(user_id=score.user_id,
+                                                                knockout_match_id=match._id).first()
+                if pick is not None or match.match_date > today:
+                    knockout_max += scoring.knockout_match_points(match.match_date, stage_list)
+        results[score.user_id] = (group_max if can_score else 0, knockout_max)
+    return results
+
+
+def naive_what_if(world_cup, tournament_id, team_id):
+    # analytics.what_if the same way: (projected low, projected high) per player
+    group_states = naive_groups(world_cup, tournament_id)
+    stage_list = [(stage.start_date, stage.end_date, stage.points)
+                  for stage in world_cup.stages.query.filter_by(tournament_id=tournament_id)
+                  .order_by(world_cup.stages._id)]
+    knockout_list = world_cup.knockout_matches.query.filter(
+        world_cup.knockout_matches.tournament_id == tournament_id, world_cup.knockout_matches.is_played.is_(False),
+        world_cup.db.or_(world_cup.knockout_matches.team_1_id == team_id,
+                         world_cup.knockout_matches.team_2_id == team_id)).all()
+    results = {}
+    for score in world_cup.scores.query.filter_by(tournament_id=tournament_id).all():
+        user_picks = {}
+        for pick in world_cup.picks.query.filter_by(user_id=score.user_id).order_by(world_cup.picks._id):
+            user_picks.setdefault(pick.group_id, (pick.first_seed_id, pick.second_seed_id))
+        pick_count = world_cup.picks.query.filter_by(user_id=score.user_id).count()
+        low = high = score.total_points
+        for group_id, team_ids, points, remaining, started, complete_schedule in group_states:
+            if team_id in team_ids and remaining and complete_schedule and group_id in user_picks \
+                    and pick_count == len(group_states):
+                outcomes = [scoring.pick_points(*user_picks[group_id], *seeds)
+                            for seeds in naive_outcomes(team_ids, points, remaining, team_id)]
+                low += min(outcomes)
+                high += max(outcomes)
+        for match in knockout_list:
+            pick = world_cup.knockout_picks.query.filter_by(user_id=score.user_id, knockout_match_id=match._id).first()
+            if pick is not None and pick.winner == team_id:
+                low += scoring.knockout_match_points(match.match_date, stage_list)
+                high += scoring.knockout_match_points(match.match_date, stage_list)
+        results[score.user_id] = (low, high)
+    return results
+
+
+def run_analytics(world_cup, user_count, team_id):
+    import analytics
+    tournament_id = current_app.config['DEFAULT_TOURNAMENT_ID']
+    today = date.today()
+    timings = {}
+    started = time.perf_counter()
+    frames = analytics.load_frames(tournament_id)
+    timings['load'] = time.perf_counter() - started
+    started = time.perf_counter()
+    analytics.pick_distribution(frames)
+    table = analytics.max_points(frames, today)
+    projection = analytics.what_if(frames, team_id)
+    timings['vectorized'] = time.perf_counter() - started
+    started = time.perf_counter()
+    naive_max = naive_max_points(world_cup, tournament_id, today)
+    naive_projection = naive_what_if(world_cup, tournament_id, team_id)
+    timings['naive'] = time.perf_counter() - started
+
+    vectorized_max = {user_id: (row.max_group_points, row.max_knockout_points) for user_id, row in table.iterrows()}
+    vectorized_projection = {user_id: (row.projected_low, row.projected_high)
+                             for user_id, row in projection.iterrows()}
+    mismatches = sum(vectorized_max.get(user_id) != value for user_id, value in naive_max.items()) + \
+        sum(vectorized_projection.get(user_id) != value for user_id, value in naive_projection.items())
+    print(f"{user_count:>6} users analytics load {timings['load'] * 1000:8.1f} ms  "
+          f"vectorized {timings['vectorized'] * 1000:8.1f} ms  naive {timings['naive'] * 1000:9.1f} ms  "
+          f"{timings['naive'] / (timings['load'] + timings['vectorized']):6.1f}x  {mismatches} mismatches",
+          file=sys.stderr)
+    if mismatches:
+        raise SystemExit('analytics and the naive implementation disagree')
+    return dict(users=user_count, route='analytics', load_ms=timings['load'] * 1000,
+                vectorized_ms=timings['vectorized'] * 1000, naive_ms=timings['naive'] * 1000)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the main routes against a generated tournament.')
+    parser.add_argument('--users', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--requests', type=int, default=20, help='requests per route and user count')
+    parser.add_argument('--routes', nargs='+', default=ROUTES)
+    parser.add_argument('--database', help='SQLAlchemy URL of a throwaway database, defaults to a temporary SQLite file')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--explain', action='store_true', help='check that the hot lookups use their indexes')
+    parser.add_argument('--analytics', action='store_true', help='compare analytics.py with per-player loops')
+    parser.add_argument('--team', type=int, default=29, help='team of the --analytics what-if projection')
+    args = parser.parse_args(argv)
+
+    if args.database:
+        os.environ['DATABASE_URL'] = args.database
+    else:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    os.environ['QUERY_STATS'] = '1'
+    import app as world_cup
+    app = world_cup.create_app()
+
+    results = []
+    for user_count in args.users:
+        with app.app_context():
+            started = time.perf_counter()
+            generate_tournament(world_cup, user_count)
+            print(f'generated {user_count} users in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+            if args.explain:
+                import migrations
+                for name, plan, uses_index in migrations.explain_hot_paths(user_id=str(100000000000)):
+                    print(f"{user_count:>6} users {'index' if uses_index else 'NO INDEX':<8} {name}", file=sys.stderr)
+            if args.analytics:
+                results.append(run_analytics(world_cup, user_count, args.team))
+                continue
+        client = app.test_client()
+        login(client, str(100000000000), 'User 0')
+        for route in args.routes:
+            result = run_route(client, route, args.requests)
+            result.update(users=user_count, route=route)
+            results.append(result)
+            if not args.json:
+                print(f"{user_count:>6} users {route:<20} p50 {result['p50_ms']:8.1f} ms  p90 {result['p90_ms']:8.1f} ms"
+                      f"  p99 {result['p99_ms']:8.1f} ms  max {result['max_ms']:8.1f} ms  {result['queries']:6.1f} queries")
+    if args.json:
+        print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
 from configparser import ConfigParser
+from datetime import timedelta
+import os
 
 
 def config(filename, section='postgresql'):
@@ -17,3 +19,46 @@ def config(filename, section='postgresql'):
         raise Exception('Section {0} not found in the {1} file'.format(section, filename))
 
     return gmail
+
+
+def database_uri(environ=os.environ):
+    # DATABASE_URL wins, otherwise the postgresql section of db.ini (or DB_INI)
+    if environ.get('DATABASE_URL'):
+        return environ['DATABASE_URL']
+    params = config(environ.get('DB_INI', 'db.ini'))
+    user = params.get('user')
+    password = params.get('password')
+    host = params.get('host')
+    database = params.get('database')
+    return f'postgresql://{user}:{password}@{host}/{database}'
+
+
+def engine_options(uri, environ=os.environ):
+    # nothing connects until the first query, the pool then holds at most pool_size + max_overflow per worker
+    options = {
+        'pool_pre_ping': environ.get('DB_POOL_PRE_PING', '1') == '1',
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    if not uri.startswith('sqlite'):
+        options['pool_size'] = int(environ.get('DB_POOL_SIZE', 5))
+        options['max_overflow'] = int(environ.get('DB_MAX_OVERFLOW', 5))
+        options['pool_timeout'] = int(environ.get('DB_POOL_TIMEOUT', 30))
+    return options
+
+
+def settings(environ=os.environ, uri=None):
+    uri = uri or database_uri(environ)
+    return {
+        'SQLALCHEMY_DATABASE_URI': uri,
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options(uri, environ),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SECRET_KEY': environ.get('SECRET_KEY', 'cactus'),
+        'PERMANENT_SESSION_LIFETIME': timedelta(minutes=2000000),
+        'QUERY_STATS': environ.get('QUERY_STATS') == '1',
+        'QUERY_STATS_FOOTER': environ.get('QUERY_STATS_FOOTER') == '1',
+        'DEFAULT_TOURNAMENT_ID': int(environ.get('DEFAULT_TOURNAMENT_ID', 1)),
+        'LEADERBOARD_PAGE_SIZE': int(environ.get('LEADERBOARD_PAGE_SIZE', 50)),
+        'SCORE_WORKER': environ.get('SCORE_WORKER', 'thread'),
+        'LIVE_STREAM': environ.get('LIVE_STREAM') == '1',
+        'ADMIN_USER_IDS': environ.get('ADMIN_USER_IDS', '106567334648237059170').split(','),
+    }
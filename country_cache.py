@@ -0,0 +1,63 @@
+from threading import Lock
+
+
+class Country:
+    __slots__ = ('_id', 'name', 'flag_name')
+
+    def __init__(self, _id, name, flag_name):
+        self._id = _id
+        self.name = name
+        self.flag_name = flag_name
+
+
+class CountryCache:
+    # id -> Country for the whole countries table, loaded in one query and kept until invalidated
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.countries = None
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.lock = Lock()
+
+    def load(self):
+        with self.lock:
+            self.countries = {row[0]: Country(*row) for row in self.loader()}
+            self.loads += 1
+
+    def invalidate(self):
+        self.countries = None
+
+    def get(self, country_id):
+        if country_id is None:
+            return None
+        country_id = int(country_id)
+        countries = self.countries
+        if countries is not None and country_id in countries:
+            self.hits += 1
+            return countries[country_id]
+        self.misses += 1
+        self.load()
+        return self.countries.get(country_id)
+
+    def name(self, country_id):
+        return self.get(country_id).name
+
+    def all(self):
+        if self.countries is None:
+            self.misses += 1
+            self.load()
+        else:
+            self.hits += 1
+        return sorted(self.countries.values(), key=lambda country: country._id)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'loads': self.loads,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self.countries) if self.countries is not None else 0,
+        }
@@ -0,0 +1,126 @@
+import heapq
+import time
+from collections import defaultdict
+from threading import Lock
+from types import SimpleNamespace
+
+from flask import before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryStats:
+    # opt-in per request query count, db time, slowest statements and template render time. The totals belong
+    # to the app in app.extensions, one instance serves every app built by create_app().
+
+    def __init__(self, app=None, **kwargs):
+        if app is not None:
+            self.init_app(app, **kwargs)
+
+    def init_app(self, app, allowed):
+        # allowed() decides who may read /debug/query_stats, the statements can hold user data
+        app.config.setdefault('QUERY_STATS', False)
+        app.config.setdefault('QUERY_STATS_FOOTER', False)
+        app.config.setdefault('QUERY_STATS_SLOW_MS', 100)
+        app.config.setdefault('QUERY_STATS_SLOWEST', 5)
+        if not app.config['QUERY_STATS']:
+            return
+        app.extensions['query_stats'] = SimpleNamespace(
+            routes=defaultdict(lambda: dict(requests=0, queries=0, max_queries=0, db_time=0.0, template_time=0.0,
+                                            request_time=0.0, slowest=[])),
+            lock=Lock(), allowed=allowed)
+        if not event.contains(Engine, 'before_cursor_execute', self.before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+        before_render_template.connect(self.before_render, app)
+        template_rendered.connect(self.after_render, app)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.add_url_rule('/debug/query_stats', 'query_stats', self.summary_view)
+
+    def start_request(self):
+        g.query_stats = dict(queries=0, db_time=0.0, template_time=0.0, slowest=[], started=time.perf_counter())
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'query_stats' in g:
+            conn.info.setdefault('query_stats_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not has_request_context() or 'query_stats' not in g:
+            return
+        elapsed = time.perf_counter() - conn.info['query_stats_start'].pop()
+        stats = g.query_stats
+        stats['queries'] += 1
+        stats['db_time'] += elapsed
+        slowest = stats['slowest']
+        if len(slowest) < current_app.config['QUERY_STATS_SLOWEST']:
+            heapq.heappush(slowest, (elapsed, statement))
+        elif elapsed > slowest[0][0]:
+            heapq.heapreplace(slowest, (elapsed, statement))
+        if elapsed * 1000 >= current_app.config['QUERY_STATS_SLOW_MS']:
+            current_app.logger.warning('slow query (%.1f ms) on %s: %s', elapsed * 1000, request.path, statement)
+
+    def before_render(self, sender, template, context, **extra):
+        if 'query_stats' in g:
+            g.query_stats['render_started'] = time.perf_counter()
+
+    def after_render(self, sender, template, context, **extra):
+        if 'query_stats' in g and 'render_started' in g.query_stats:
+            g.query_stats['template_time'] += time.perf_counter() - g.query_stats.pop('render_started')
+
+    def finish_request(self, response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+        request_time = time.perf_counter() - stats['started']
+        response.headers['X-Query-Count'] = str(stats['queries'])
+        response.headers['X-DB-Time-Ms'] = f"{stats['db_time'] * 1000:.2f}"
+        response.headers['X-Template-Time-Ms'] = f"{stats['template_time'] * 1000:.2f}"
+        response.headers['X-Request-Time-Ms'] = f'{request_time * 1000:.2f}'
+        route = f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+        state = current_app.extensions['query_stats']
+        with state.lock:
+            summary = state.routes[route]
+            summary['requests'] += 1
+            summary['queries'] += stats['queries']
+            summary['max_queries'] = max(summary['max_queries'], stats['queries'])
+            summary['db_time'] += stats['db_time']
+            summary['template_time'] += stats['template_time']
+            summary['request_time'] += request_time
+            summary['slowest'] = heapq.nlargest(current_app.config['QUERY_STATS_SLOWEST'],
+                                                summary['slowest'] + stats['slowest'])
+        if current_app.config['QUERY_STATS_FOOTER'] and response.mimetype == 'text/html' and not response.direct_passthrough:
+            footer = (f"<footer style=\"font-size:small;color:grey\">{stats['queries']} queries, "
+                      f"{stats['db_time'] * 1000:.1f} ms db, {stats['template_time'] * 1000:.1f} ms templates, "
+                      f"{request_time * 1000:.1f} ms total</footer>")
+            body = response.get_data(as_text=True)
+            if '</body>' in body:
+                response.set_data(body.replace('</body>', footer + '</body>', 1))
+        return response
+
+    def summary(self):
+        state = current_app.extensions['query_stats']
+        with state.lock:
+            routes = {}
+            for route, summary in state.routes.items():
+                requests = summary['requests']
+                routes[route] = dict(
+                    requests=requests,
+                    avg_queries=summary['queries'] / requests,
+                    max_queries=summary['max_queries'],
+                    avg_db_ms=summary['db_time'] * 1000 / requests,
+                    avg_template_ms=summary['template_time'] * 1000 / requests,
+                    avg_request_ms=summary['request_time'] * 1000 / requests,
+                    slowest=[dict(ms=elapsed * 1000, statement=statement) for elapsed, statement in summary['slowest']],
+                )
+            return routes
+
+    def reset(self):
+        state = current_app.extensions['query_stats']
+        with state.lock:
+            state.routes.clear()
+
+    def summary_view(self):
+        if not current_app.extensions['query_stats'].allowed():
+            return dict(error='admin login required'), 403
+        return self.summary()
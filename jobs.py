@@ -0,0 +1,178 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from flask import current_app
+
+from models import db, score_jobs
+
+
+class ScoreJobRunner:
+    # Result and pick changes are queued in the score_jobs table and scored outside the request. Every job of a
+    # tournament that is pending when a run starts is claimed at once, so a burst of results is scored in one
+    # pass. The claim is a single UPDATE, several gunicorn workers and 'flask score-worker' can run side by side.
+    #   SCORE_WORKER=thread    each process scores in a background thread (default)
+    #   SCORE_WORKER=external  requests only queue, 'flask score-worker' does the scoring
+    #   SCORE_WORKER=inline    requests score before they return, the old behaviour
+    # The thread belongs to the app in app.extensions, one instance serves every app built by create_app().
+
+    def __init__(self, app=None, **kwargs):
+        if app is not None:
+            self.init_app(app, **kwargs)
+
+    def init_app(self, app, recompute):
+        app.config.setdefault('SCORE_WORKER', 'thread')
+        app.config.setdefault('SCORE_JOB_POLL_INTERVAL', 2.0)
+        app.config.setdefault('SCORE_JOB_COALESCE', 0.5)
+        app.config.setdefault('SCORE_JOB_BATCH', 1000)
+        app.config.setdefault('SCORE_JOB_STALE', 600)
+        app.config.setdefault('SCORE_JOB_ATTEMPTS', 3)
+        app.extensions['score_jobs'] = SimpleNamespace(recompute=recompute, thread=None, wake=threading.Event(),
+                                                       lock=threading.Lock())
+
+    @property
+    def state(self):
+        return current_app.extensions['score_jobs']
+
+    def enqueue(self, tournament_id, user_ids=None, reason=''):
+        # user_ids None rescores every player of the tournament
+        if user_ids is not None and not user_ids:
+            return
+        db.session.add(score_jobs(tournament_id, None if user_ids is None else json.dumps(sorted(user_ids)), reason))
+        db.session.commit()
+        mode = current_app.config['SCORE_WORKER']
+        if mode == 'inline':
+            # the change that queued the job is committed, a failed run is retried and must not fail the request
+            try:
+                self.run_pending()
+            except Exception:
+                current_app.logger.exception('score job run failed')
+        elif mode == 'thread':
+            self.start()
+            self.state.wake.set()
+
+    def start(self):
+        state = self.state
+        with state.lock:
+            if state.thread is None:
+                state.thread = threading.Thread(target=self.run_forever, args=(current_app._get_current_object(),),
+                                                name='score-jobs', daemon=True)
+                state.thread.start()
+
+    def run_forever(self, app=None):
+        app = app or current_app._get_current_object()
+        state = app.extensions['score_jobs']
+        while True:
+            state.wake.wait(app.config['SCORE_JOB_POLL_INTERVAL'])
+            state.wake.clear()
+            # a short pause lets the rest of a burst land in the same run
+            time.sleep(app.config['SCORE_JOB_COALESCE'])
+            try:
+                with app.app_context():
+                    self.run_pending()
+            except Exception:
+                app.logger.exception('score job run failed')
+
+    def claim(self):
+        # (tournament_id, worker token) of the claimed jobs, or None when nothing is waiting
+        # jobs left running by a worker that died are picked up again once they are stale, a tournament with a
+        # run in progress is left alone so two workers never score it at the same time
+        stale = datetime.utcnow() - timedelta(seconds=current_app.config['SCORE_JOB_STALE'])
+        attempts = current_app.config['SCORE_JOB_ATTEMPTS']
+        abandoned = db.and_(score_jobs.status == 'running', score_jobs.started_at < stale)
+        # a job that keeps killing its worker fails like one that raises
+        db.session.execute(db.update(score_jobs).where(abandoned, score_jobs.attempts >= attempts).values(
+            status='failed', error='worker stopped', finished_at=datetime.utcnow()))
+        db.session.commit()
+        running = db.aliased(score_jobs)
+        waiting = db.and_(
+            db.or_(score_jobs.status == 'pending', abandoned),
+            ~db.exists().where(running.tournament_id == score_jobs.tournament_id, running.status == 'running',
+                               running.started_at >= stale))
+        while True:
+            tournament_id = db.session.query(score_jobs.tournament_id).filter(waiting) \
+                .order_by(score_jobs._id).limit(1).scalar()
+            if tournament_id is None:
+                db.session.rollback()
+                return None
+            token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+            claimed = db.session.execute(
+                db.update(score_jobs).where(waiting, score_jobs.tournament_id == tournament_id)
+                .values(status='running', worker=token, started_at=datetime.utcnow(), users_done=0,
+                        attempts=score_jobs.attempts + 1).execution_options(synchronize_session=False)).rowcount
+            db.session.commit()
+            # nothing claimed means another worker was quicker, look again
+            if claimed:
+                return tournament_id, token
+
+    def run_pending(self):
+        # scores everything that is waiting, one tournament per pass, returns the number of runs
+        runs = 0
+        while True:
+            claimed = self.claim()
+            if claimed is None:
+                return runs
+            tournament_id, token = claimed
+            mine = score_jobs.worker == token
+            user_ids = set()
+            for (job_user_ids,) in db.session.query(score_jobs.user_ids).filter(mine).all():
+                if job_user_ids is None:
+                    user_ids = None
+                    break
+                user_ids.update(json.loads(job_user_ids))
+
+            def progress(done, total):
+                # the scores of a run are committed together with their ranks, progress goes through a connection
+                # of its own. SQLite has one writer at a time, there it is committed with the scores.
+                update = db.update(score_jobs).where(mine).values(users_done=done, users_total=total)
+                if db.engine.dialect.name == 'sqlite':
+                    db.session.execute(update)
+                else:
+                    with db.engine.begin() as connection:
+                        connection.execute(update)
+
+            try:
+                self.state.recompute(tournament_id, user_ids, progress, current_app.config['SCORE_JOB_BATCH'])
+            except Exception as error:
+                db.session.rollback()
+                # tried again on the next run until SCORE_JOB_ATTEMPTS is used up
+                retry = score_jobs.attempts < current_app.config['SCORE_JOB_ATTEMPTS']
+                db.session.execute(db.update(score_jobs).where(mine, retry).values(
+                    status='pending', worker=None, started_at=None, error=repr(error)[:500]))
+                db.session.execute(db.update(score_jobs).where(mine, ~retry).values(
+                    status='failed', error=repr(error)[:500], finished_at=datetime.utcnow()))
+                db.session.commit()
+                raise
+            db.session.execute(db.update(score_jobs).where(mine).values(status='done',
+                                                                        finished_at=datetime.utcnow()))
+            # the queue only needs recent history for the status
+            db.session.execute(db.delete(score_jobs).where(
+                score_jobs.status == 'done', score_jobs.finished_at < datetime.utcnow() - timedelta(days=1)))
+            db.session.commit()
+            runs += 1
+
+    def status(self):
+        pending = dict(db.session.query(score_jobs.tournament_id, db.func.count())
+                       .filter(score_jobs.status == 'pending').group_by(score_jobs.tournament_id).all())
+        running = db.session.query(score_jobs.tournament_id, db.func.max(score_jobs.users_done),
+                                   db.func.max(score_jobs.users_total), db.func.min(score_jobs.started_at)) \
+            .filter(score_jobs.status == 'running').group_by(score_jobs.tournament_id).all()
+        finished = db.session.query(score_jobs.tournament_id, score_jobs.status, db.func.max(score_jobs.finished_at)) \
+            .filter(score_jobs.status.in_(['done', 'failed'])).group_by(score_jobs.tournament_id, score_jobs.status)
+        last_completed = {}
+        last_failed = {}
+        for tournament_id, status, finished_at in finished.all():
+            (last_completed if status == 'done' else last_failed)[tournament_id] = finished_at.isoformat()
+        return dict(
+            mode=current_app.config['SCORE_WORKER'],
+            pending=pending,
+            running={tournament_id: dict(users_done=done, users_total=total, started_at=started_at.isoformat())
+                     for tournament_id, done, total, started_at in running},
+            last_completed=last_completed,
+            last_failed=last_failed,
+        )
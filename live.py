@@ -0,0 +1,134 @@
+import json
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+from flask import current_app
+
+
+def diff(old, new):
+    # rows of new that are added or changed compared to old, and the keys that disappeared
+    changed = {key: value for key, value in new.items() if old.get(key) != value}
+    removed = [key for key in old if key not in new]
+    return changed, removed
+
+
+class LiveBroadcaster:
+    # One poller per process watches the page cache versions of every channel (a tournament) that has listeners
+    # and, when one moves, loads a single snapshot of it and fans the difference out to that channel's listeners.
+    # Listeners cost a queue each and never touch the database, so a gevent worker can hold thousands of them.
+    # Listeners and the poller belong to the app in app.extensions, one instance serves every app built by
+    # create_app().
+
+    def __init__(self, app=None, **kwargs):
+        if app is not None:
+            self.init_app(app, **kwargs)
+
+    def init_app(self, app, snapshot, version):
+        app.config.setdefault('LIVE_POLL_INTERVAL', 1.0)
+        app.config.setdefault('LIVE_HEARTBEAT', 15.0)
+        app.config.setdefault('LIVE_QUEUE_SIZE', 100)
+        app.extensions['live'] = SimpleNamespace(load_snapshot=snapshot, version=version, listeners={}, snapshots={},
+                                                 versions={}, lock=threading.Lock(), thread=None, published=0)
+
+    @property
+    def state(self):
+        return current_app.extensions['live']
+
+    def subscribe(self, channel):
+        state = self.state
+        listener = queue.Queue(maxsize=current_app.config['LIVE_QUEUE_SIZE'])
+        with state.lock:
+            state.listeners.setdefault(channel, set()).add(listener)
+            if state.thread is None:
+                state.thread = threading.Thread(target=self.run, args=(current_app._get_current_object(),),
+                                                name='live-broadcaster', daemon=True)
+                state.thread.start()
+        return listener
+
+    def unsubscribe(self, listener, state=None):
+        state = state or self.state
+        with state.lock:
+            for channel, listeners in list(state.listeners.items()):
+                listeners.discard(listener)
+                if not listeners:
+                    # forget the snapshot too, the next listener starts from a fresh one
+                    del state.listeners[channel]
+                    state.snapshots.pop(channel, None)
+                    state.versions.pop(channel, None)
+
+    def publish(self, channel, event):
+        state = self.state
+        message = f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+        with state.lock:
+            listeners = list(state.listeners.get(channel, ()))
+        for listener in listeners:
+            try:
+                listener.put_nowait(message)
+            except queue.Full:
+                # a listener this far behind gets disconnected, the browser reconnects and reloads the page. The
+                # queue is emptied first, a blocking put would stall the poller for every other listener.
+                self.unsubscribe(listener, state)
+                while True:
+                    try:
+                        listener.get_nowait()
+                    except queue.Empty:
+                        break
+                listener.put_nowait(None)
+        state.published += 1
+
+    def poll(self, channel):
+        state = self.state
+        version = state.version(channel)
+        if version == state.versions.get(channel):
+            return
+        snapshot = state.load_snapshot(channel)
+        previous = state.snapshots.get(channel)
+        if previous is not None:
+            for kind, rows in snapshot.items():
+                changed, removed = diff(previous.get(kind, {}), rows)
+                if changed or removed:
+                    self.publish(channel, dict(type=kind, data=dict(changed=changed, removed=removed)))
+        state.snapshots[channel] = snapshot
+        state.versions[channel] = version
+
+    def run(self, app):
+        state = app.extensions['live']
+        while True:
+            with state.lock:
+                channels = list(state.listeners)
+            for channel in channels:
+                try:
+                    with app.app_context():
+                        self.poll(channel)
+                except Exception:
+                    app.logger.exception('live update failed')
+            time.sleep(app.config['LIVE_POLL_INTERVAL'])
+
+    def stream(self, listener):
+        # called in the request, the generator runs after it and only uses what is read here
+        state = self.state
+        heartbeat = current_app.config['LIVE_HEARTBEAT']
+
+        def events():
+            try:
+                yield 'retry: 5000\n\n'
+                while True:
+                    try:
+                        message = listener.get(timeout=heartbeat)
+                    except queue.Empty:
+                        yield ': keep-alive\n\n'
+                        continue
+                    if message is None:
+                        return
+                    yield message
+            finally:
+                self.unsubscribe(listener, state)
+
+        return events()
+
+    def stats(self):
+        state = self.state
+        return dict(listeners=sum(len(listeners) for listeners in state.listeners.values()),
+                    channels=sorted(state.listeners), published=state.published, polling=state.thread is not None)
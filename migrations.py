@@ -0,0 +1,204 @@
+# Ordered schema migrations, applied with 'flask migrate' and recorded in the schema_migrations table.
+# Every step is written so it can run on a database created by db.create_all() as well as on the
+# original production schema.
+from datetime import date, datetime
+
+from models import db
+
+
+def create_missing_tables(connection):
+    # scores and standings were added after the first deployment
+    db.metadata.create_all(connection, checkfirst=True)
+
+
+def unique_picks(connection):
+    # the first pick is the one every lookup used, later duplicates were never read
+    connection.execute(db.text(
+        'DELETE FROM picks WHERE id NOT IN (SELECT MIN(id) FROM picks GROUP BY user_id, group_id)'))
+    connection.execute(db.text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_picks_user_group ON picks (user_id, group_id)'))
+    connection.execute(db.text('CREATE INDEX IF NOT EXISTS ix_picks_group ON picks (group_id)'))
+
+
+def unique_knockout_picks(connection):
+    # knockout picks lock on the first submit, a double submit only added a second row
+    connection.execute(db.text(
+        'DELETE FROM knockout_picks WHERE id NOT IN '
+        '(SELECT MIN(id) FROM knockout_picks GROUP BY user_id, knockout_match_id)'))
+    connection.execute(db.text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_knockout_picks_user_match '
+        'ON knockout_picks (user_id, knockout_match_id)'))
+    connection.execute(db.text(
+        'CREATE INDEX IF NOT EXISTS ix_knockout_picks_match ON knockout_picks (knockout_match_id)'))
+
+
+def match_team_indexes(connection):
+    connection.execute(db.text(
+        'CREATE INDEX IF NOT EXISTS ix_matches_team_1_played ON matches (team_1_id, is_played)'))
+    connection.execute(db.text(
+        'CREATE INDEX IF NOT EXISTS ix_matches_team_2_played ON matches (team_2_id, is_played)'))
+
+
+# the 2022 rule was a date cutoff: knockout matches after 11 December are worth 2 points, earlier ones 1
+WORLD_CUP_2022_STAGES = [
+    ('Round of 16', date(2022, 12, 3), date(2022, 12, 11), 1),
+    ('Quarter-finals to final', date(2022, 12, 12), None, 2),
+]
+
+
+def seed_world_cup_2022(connection):
+    tournament_id = connection.execute(
+        db.metadata.tables['tournaments'].insert().values(name='World Cup 2022')).inserted_primary_key[0]
+    connection.execute(db.metadata.tables['stages'].insert(), [
+        dict(tournament_id=tournament_id, name=name, start_date=start_date, end_date=end_date, points=points)
+        for name, start_date, end_date, points in WORLD_CUP_2022_STAGES])
+    return tournament_id
+
+
+def tournaments(connection):
+    # everything that existed so far becomes the World Cup 2022 tournament
+    db.metadata.create_all(connection, checkfirst=True)
+    inspector = db.inspect(connection)
+    for table in ('groups', 'matches', 'knockout_matches'):
+        if 'tournament_id' not in {column['name'] for column in inspector.get_columns(table)}:
+            connection.execute(db.text(
+                f'ALTER TABLE {table} ADD COLUMN tournament_id INTEGER REFERENCES tournaments (id)'))
+        connection.execute(db.text(
+            f'CREATE INDEX IF NOT EXISTS ix_{table}_tournament_id ON {table} (tournament_id)'))
+    # scores and standings only hold derived numbers, they are recreated with the tournament in their key and
+    # refilled by 'flask migrate'
+    for model in (db.metadata.tables['scores'], db.metadata.tables['standings']):
+        if 'tournament_id' not in {column['name'] for column in inspector.get_columns(model.name)}:
+            model.drop(connection)
+            model.create(connection)
+    tournament_id = connection.execute(db.text('SELECT MIN(id) FROM tournaments')).scalar()
+    if tournament_id is None:
+        tournament_id = seed_world_cup_2022(connection)
+    for table in ('groups', 'matches', 'knockout_matches'):
+        connection.execute(db.text(f'UPDATE {table} SET tournament_id = :tournament_id WHERE tournament_id IS NULL'),
+                           dict(tournament_id=tournament_id))
+
+
+def leaderboard_index(connection):
+    connection.execute(db.text(
+        'CREATE INDEX IF NOT EXISTS ix_scores_leaderboard ON scores (tournament_id, total_points DESC, user_id)'))
+
+
+def score_jobs_table(connection):
+    db.metadata.tables['score_jobs'].create(connection, checkfirst=True)
+
+
+def leaderboard_snapshot_tables(connection):
+    db.metadata.tables['leaderboard_rosters'].create(connection, checkfirst=True)
+    db.metadata.tables['leaderboard_snapshots'].create(connection, checkfirst=True)
+
+
+def knockout_winner_nulls(connection):
+    # the first version stored unplayed knockout matches with winner 0, which is no country
+    connection.execute(db.text('UPDATE knockout_matches SET winner = NULL WHERE winner = 0'))
+
+
+# a row whose owner is gone (the user of a pick, the match of a knockout pick) is deleted, any other reference
+# that points nowhere becomes NULL
+OWNER_COLUMNS = {'user_id', 'group_id', 'knockout_match_id', 'pool_id', 'roster_id'}
+
+
+def foreign_keys(connection):
+    # the foreign keys of models.py for tables created before them, after clearing the rows that would break them.
+    # SQLite cannot add a constraint to an existing table, there they only exist on tables made by create_all.
+    inspector = db.inspect(connection)
+    for table in db.metadata.sorted_tables:
+        constrained = {tuple(key['constrained_columns']) for key in inspector.get_foreign_keys(table.name)}
+        for key in table.foreign_keys:
+            column, target = key.parent, key.column
+            dangling = f'{column.name} IS NOT NULL AND {column.name} NOT IN ' \
+                       f'(SELECT {target.name} FROM {target.table.name})'
+            if column.primary_key or column.name in OWNER_COLUMNS or not column.nullable:
+                connection.execute(db.text(f'DELETE FROM {table.name} WHERE {dangling}'))
+            else:
+                connection.execute(db.text(f'UPDATE {table.name} SET {column.name} = NULL WHERE {dangling}'))
+            if connection.dialect.name != 'sqlite' and (column.name,) not in constrained:
+                connection.execute(db.text(
+                    f'ALTER TABLE {table.name} ADD CONSTRAINT fk_{table.name}_{column.name} '
+                    f'FOREIGN KEY ({column.name}) REFERENCES {target.table.name} ({target.name})'))
+
+
+def score_job_attempts(connection):
+    # failed jobs go back to pending until they have been tried SCORE_JOB_ATTEMPTS times
+    if 'attempts' not in {column['name'] for column in db.inspect(connection).get_columns('score_jobs')}:
+        connection.execute(db.text('ALTER TABLE score_jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0'))
+
+
+MIGRATIONS = [
+    (1, 'create missing tables', create_missing_tables),
+    (2, 'unique picks per user and group', unique_picks),
+    (3, 'unique knockout picks per user and match', unique_knockout_picks),
+    (4, 'indexes on matches by team and played', match_team_indexes),
+    (5, 'tournaments, stages and pools', tournaments),
+    (6, 'leaderboard index on scores', leaderboard_index),
+    (7, 'score job queue', score_jobs_table),
+    (8, 'leaderboard snapshots', leaderboard_snapshot_tables),
+    (9, 'no winner instead of winner 0', knockout_winner_nulls),
+    (10, 'foreign keys on existing tables', foreign_keys),
+    (11, 'score job attempts', score_job_attempts),
+]
+
+
+def applied_versions(connection):
+    connection.execute(db.text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations '
+        '(version INTEGER PRIMARY KEY, name VARCHAR(500), applied_at TIMESTAMP)'))
+    return {row[0] for row in connection.execute(db.text('SELECT version FROM schema_migrations'))}
+
+
+def migrate():
+    # each migration runs in its own transaction together with its schema_migrations row
+    applied = []
+    with db.engine.begin() as connection:
+        done = applied_versions(connection)
+    for version, name, step in MIGRATIONS:
+        if version in done:
+            continue
+        with db.engine.begin() as connection:
+            step(connection)
+            connection.execute(db.text(
+                'INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)'),
+                dict(version=version, name=name, applied_at=datetime.utcnow()))
+        applied.append((version, name))
+    return applied
+
+
+HOT_PATHS = [
+    ('picks by user and group', 'SELECT * FROM picks WHERE user_id = :user_id AND group_id = :group_id'),
+    ('picks by group', 'SELECT user_id FROM picks WHERE group_id = :group_id'),
+    ('knockout picks by user and match',
+     'SELECT * FROM knockout_picks WHERE user_id = :user_id AND knockout_match_id = :knockout_match_id'),
+    ('knockout picks by match', 'SELECT user_id FROM knockout_picks WHERE knockout_match_id = :knockout_match_id'),
+    ('matches by team 1', 'SELECT * FROM matches WHERE team_1_id = :team_id AND is_played = :is_played'),
+    ('matches by team 2', 'SELECT * FROM matches WHERE team_2_id = :team_id AND is_played = :is_played'),
+    ('leaderboard page', 'SELECT user_id FROM scores WHERE tournament_id = :tournament_id AND (total_points < 10 OR '
+                         '(total_points = 10 AND user_id > :user_id)) ORDER BY total_points DESC, user_id LIMIT 50'),
+]
+
+
+def explain_hot_paths(user_id='0', group_id=1, knockout_match_id=1, team_id=1, tournament_id=1):
+    # (name, plan, uses an index) for each hot lookup, on the data currently in the database
+    parameters = dict(user_id=user_id, group_id=group_id, knockout_match_id=knockout_match_id, team_id=team_id,
+                      tournament_id=tournament_id, is_played=True)
+    dialect = db.engine.dialect.name
+    results = []
+    with db.engine.connect() as connection:
+        if dialect == 'postgresql':
+            connection.execute(db.text('ANALYZE picks, knockout_picks, matches, scores'))
+        for name, sql in HOT_PATHS:
+            if dialect == 'sqlite':
+                rows = connection.execute(db.text('EXPLAIN QUERY PLAN ' + sql), parameters).all()
+                plan = '\n'.join(row[-1] for row in rows)
+                # an index that only narrows the rows still leaves a sort for the leaderboard page
+                uses_index = ('USING INDEX' in plan or 'USING COVERING INDEX' in plan) and 'TEMP B-TREE' not in plan
+            else:
+                rows = connection.execute(db.text('EXPLAIN ' + sql), parameters).all()
+                plan = '\n'.join(row[0] for row in rows)
+                uses_index = ('Index Scan' in plan or 'Index Only Scan' in plan) and 'Sort' not in plan
+            results.append((name, plan, uses_index))
+    return results
@@ -0,0 +1,507 @@
+from datetime import datetime
+from flask_login import UserMixin
+from flask_sqlalchemy import SQLAlchemy
+from country_cache import CountryCache
+
+db = SQLAlchemy()
+
+
+# models
+class users(db.Model, UserMixin):
+    _id = db.Column("id", db.String(500), primary_key=True)
+    email = db.Column(db.String(500))
+    name = db.Column(db.String(500))
+
+    def knockout_points(self):
+        points = 0
+        all_picks_k = knockout_picks.query.filter_by(user_id=self._id).all()
+        for p in all_picks_k:
+            knockout_match = knockout_matches.query.filter_by(_id=p.knockout_match_id).first()
+            if knockout_match.is_played == True:
+                if p.winner == knockout_match.winner:
+                    if knockout_match.match_date > datetime(2022, 12, 11).date():
+                        points += 2
+                    elif knockout_match.match_date > datetime(2022, 12, 15).date():
+                        points += 4
+                    else:
+                        points += 1
+        return points
+
+    def calc_points(self):
+        # 3 points for 2 correct teams + order
+        # 2 points for 2 correct teams + incorrect order
+        # 1 point for 1 correct team in any order.
+        points = 0
+        if len(picks.query.filter_by(user_id=self._id).all()) == 8:
+            all_groups = groups.query.all()
+            for group in all_groups:
+                played = 0
+                teams = [group.team_1_id, group.team_2_id, group.team_3_id, group.team_4_id]
+                for team in teams:
+                    played += group.get_played_by_team(team)
+                if played == 12:
+                    first_pick = picks.query.filter_by(user_id=self._id, group_id=group._id).first().first_seed_id
+                    second_pick = picks.query.filter_by(user_id=self._id, group_id=group._id).first().second_seed_id
+                    team_1_points = group.team_1_points
+                    team_2_points = group.team_2_points
+                    team_3_points = group.team_3_points
+                    team_4_points = group.team_4_points
+                    team_1_tuple = (group.team_1_id, team_1_points)
+                    team_2_tuple = (group.team_2_id, team_2_points)
+                    team_3_tuple = (group.team_3_id, team_3_points)
+                    team_4_tuple = (group.team_4_id, team_4_points)
+                    team_tuples = [team_1_tuple, team_2_tuple, team_3_tuple, team_4_tuple]
+                    first_seed_tuple = max(team_tuples, key=lambda item: item[1])
+                    first_seed = first_seed_tuple[0]
+                    team_tuples.remove(first_seed_tuple)
+                    second_seed = max(team_tuples, key=lambda item: item[1])[0]
+
+                    if first_pick == first_seed and second_pick == second_seed:
+                        points += 3
+                    elif first_pick == second_seed and second_pick == first_seed:
+                        points += 2
+                    elif first_pick == first_seed or first_pick == second_seed or second_pick == first_seed or second_pick == second_seed:
+                        points += 1
+        return points
+
+    def has_picks(self):
+        has_pick = picks.query.filter_by(user_id=self._id).count()
+        return has_pick
+
+    def get_id(self):
+        return self._id
+
+    def __init__(self, _id, email, name):
+        self._id = _id
+        self.email = email
+        self.name = name
+
+
+class knockout_matches(db.Model):
+    _id = db.Column("id", db.Integer, primary_key=True)
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'), index=True)
+    team_1_id = db.Column(db.Integer, db.ForeignKey('countries.id'))
+    team_2_id = db.Column(db.Integer, db.ForeignKey('countries.id'))
+    winner = db.Column(db.Integer, db.ForeignKey('countries.id'))
+    is_played = db.Column(db.Boolean)
+    match_date = db.Column(db.Date)
+    team_1 = db.relationship('countries', foreign_keys=[team_1_id])
+    team_2 = db.relationship('countries', foreign_keys=[team_2_id])
+    winner_country = db.relationship('countries', foreign_keys=[winner])
+    picks = db.relationship('knockout_picks', back_populates='knockout_match')
+
+    def user_picked(self, user_id):
+        if len(knockout_picks.query.filter_by(user_id=user_id, knockout_match_id=self._id).all()):
+            return True
+        else:
+            return False
+
+    def get_pick_by_user(self, user_id):
+        return country_cache.name(knockout_picks.query.filter_by(user_id=user_id, knockout_match_id=self._id).first().winner)
+
+    def get_winner_country(self):
+        return country_cache.name(self.winner)
+
+    def get_country_1(self):
+        return country_cache.name(self.team_1_id)
+
+    def get_country_2(self):
+        return country_cache.name(self.team_2_id)
+
+    def __init__(self, team_1_id, team_2_id, winner, is_played, match_date, tournament_id=None):
+        self.team_1_id = team_1_id
+        self.team_2_id = team_2_id
+        self.winner = winner
+        self.is_played = is_played
+        self.match_date = match_date
+        self.tournament_id = tournament_id
+
+
+class knockout_picks(db.Model):
+    __table_args__ = (
+        db.Index('uq_knockout_picks_user_match', 'user_id', 'knockout_match_id', unique=True),
+        db.Index('ix_knockout_picks_match', 'knockout_match_id'),
+    )
+    _id = db.Column("id", db.Integer, primary_key=True)
+    knockout_match_id = db.Column(db.Integer, db.ForeignKey('knockout_matches.id'))
+    user_id = db.Column(db.String(500), db.ForeignKey('users.id'))
+    winner = db.Column(db.Integer, db.ForeignKey('countries.id'))
+    knockout_match = db.relationship('knockout_matches', back_populates='picks')
+    user = db.relationship('users')
+    winner_country = db.relationship('countries')
+
+    def __init__(self, knockout_match_id, user_id, winner):
+        self.knockout_match_id = knockout_match_id
+        self.user_id = user_id
+        self.winner = winner
+    # def __init__(self, knockout_match_id, user_id, winner):
+    #     self.knockout_match_id = knockout_match_id
+    #     self.winner = winner
+    #     self.user_id = user_id
+
+
+class countries(db.Model):
+    _id = db.Column("id", db.Integer, primary_key=True)
+    name = db.Column(db.String(500))
+    flag_name = db.Column(db.String(500))
+
+    def __init__(self, _id, name, flag_name):
+        self._id = _id
+        self.name = name
+        self.flag_name = flag_name
+
+
+class picks(db.Model):
+    __table_args__ = (
+        db.Index('uq_picks_user_group', 'user_id', 'group_id', unique=True),
+        db.Index('ix_picks_group', 'group_id'),
+    )
+    _id = db.Column("id", db.Integer, primary_key=True)
+    user_id = db.Column(db.String(500), db.ForeignKey('users.id'))
+    group_id = db.Column(db.Integer, db.ForeignKey('groups.id'))
+    first_seed_id = db.Column(db.Integer, db.ForeignKey('countries.id'))
+    second_seed_id = db.Column(db.Integer, db.ForeignKey('countries.id'))
+    user = db.relationship('users')
+    group = db.relationship('groups', back_populates='picks')
+    first_seed = db.relationship('countries', foreign_keys=[first_seed_id])
+    second_seed = db.relationship('countries', foreign_keys=[second_seed_id])
+
+    def country(self, country_id):
+        return country_cache.name(country_id)
+
+    def __init__(self, user_id, first_seed_id, second_seed_id, group_id):
+        self.user_id = user_id
+        self.first_seed_id = first_seed_id
+        self.second_seed_id = second_seed_id
+        self.group_id = group_id
+
+
+class matches(db.Model):
+    __table_args__ = (
+        db.Index('ix_matches_team_1_played', 'team_1_id', 'is_played'),
+        db.Index('ix_matches_team_2_played', 'team_2_id', 'is_played'),
+    )
+    _id = db.Column("id", db.Integer, primary_key=True)
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'), index=True)
+    match_date = db.Column(db.Date)
+    team_1_id = db.Column(db.Integer, db.ForeignKey('countries.id'))
+    team_2_id = db.Column(db.Integer, db.ForeignKey('countries.id'))
+    team_1_goals = db.Column(db.Integer)
+    team_2_goals = db.Column(db.Integer)
+    is_played = db.Column(db.Boolean)
+    team_1 = db.relationship('countries', foreign_keys=[team_1_id])
+    team_2 = db.relationship('countries', foreign_keys=[team_2_id])
+
+    def get_winner(self):
+        if self.is_played:
+            if self.team_1_goals == self.team_2_goals:
+                return 'Draw'
+            elif self.team_1_goals > self.team_2_goals:
+                return self.team_1_id
+            elif self.team_2_goals > self.team_1_goals:
+                return self.team_2_id
+
+    def get_country(self, team_id):
+        return country_cache.name(team_id)
+
+    def __init__(self, match_date, team_1_id, team_2_id, team_1_goals, team_2_goals, tournament_id=None):
+        self.match_date = match_date
+        self.team_1_id = team_1_id
+        self.team_2_id = team_2_id
+        self.team_1_goals = team_1_goals
+        self.team_2_goals = team_2_goals
+        self.tournament_id = tournament_id
+
+
+class scores(db.Model):
+    __table_args__ = (
+        db.Index('ix_scores_tournament_rank', 'tournament_id', 'rank'),
+    )
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'), primary_key=True)
+    user_id = db.Column(db.String(500), db.ForeignKey('users.id'), primary_key=True)
+    group_points = db.Column(db.Integer, default=0, nullable=False)
+    knockout_points = db.Column(db.Integer, default=0, nullable=False)
+    total_points = db.Column(db.Integer, default=0, nullable=False)
+    rank = db.Column(db.Integer)
+
+    def __init__(self, tournament_id, user_id):
+        self.tournament_id = tournament_id
+        self.user_id = user_id
+        self.group_points = 0
+        self.knockout_points = 0
+        self.total_points = 0
+
+
+# leaderboard order, pages and "around me" windows are range scans on it
+db.Index('ix_scores_leaderboard', scores.tournament_id, scores.total_points.desc(), scores.user_id)
+
+
+class standings(db.Model):
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'), primary_key=True)
+    team_id = db.Column(db.Integer, db.ForeignKey('countries.id'), primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('groups.id'), index=True)
+    played = db.Column(db.Integer, default=0, nullable=False)
+    won = db.Column(db.Integer, default=0, nullable=False)
+    drawn = db.Column(db.Integer, default=0, nullable=False)
+    lost = db.Column(db.Integer, default=0, nullable=False)
+    goals_for = db.Column(db.Integer, default=0, nullable=False)
+    goals_against = db.Column(db.Integer, default=0, nullable=False)
+    goal_difference = db.Column(db.Integer, default=0, nullable=False)
+    points = db.Column(db.Integer, default=0, nullable=False)
+
+    def apply(self, result, sign=1):
+        played, won, drawn, lost, goals_for, goals_against, points = result
+        self.played += sign * played
+        self.won += sign * won
+        self.drawn += sign * drawn
+        self.lost += sign * lost
+        self.goals_for += sign * goals_for
+        self.goals_against += sign * goals_against
+        self.goal_difference = self.goals_for - self.goals_against
+        self.points += sign * points
+
+    def __init__(self, tournament_id, team_id, group_id):
+        self.tournament_id = tournament_id
+        self.team_id = team_id
+        self.group_id = group_id
+        self.played = 0
+        self.won = 0
+        self.drawn = 0
+        self.lost = 0
+        self.goals_for = 0
+        self.goals_against = 0
+        self.goal_difference = 0
+        self.points = 0
+
+
+class groups(db.Model):
+    _id = db.Column("id", db.Integer, primary_key=True)
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'), index=True)
+    group_name = db.Column(db.String(500))
+    team_1_id = db.Column(db.Integer, db.ForeignKey('countries.id'))
+    team_2_id = db.Column(db.Integer, db.ForeignKey('countries.id'))
+    team_3_id = db.Column(db.Integer, db.ForeignKey('countries.id'))
+    team_4_id = db.Column(db.Integer, db.ForeignKey('countries.id'))
+    team_1_points = db.Column(db.Integer)
+    team_2_points = db.Column(db.Integer)
+    team_3_points = db.Column(db.Integer)
+    team_4_points = db.Column(db.Integer)
+    team_1 = db.relationship('countries', foreign_keys=[team_1_id])
+    team_2 = db.relationship('countries', foreign_keys=[team_2_id])
+    team_3 = db.relationship('countries', foreign_keys=[team_3_id])
+    team_4 = db.relationship('countries', foreign_keys=[team_4_id])
+    picks = db.relationship('picks', back_populates='group')
+
+    def get_played_by_team(self, team_id):
+        matches_played_1 = len(matches.query.filter_by(team_1_id=team_id, is_played=True).all())
+        matches_played_2 = len(matches.query.filter_by(team_2_id=team_id, is_played=True).all())
+        return matches_played_2 + matches_played_1
+
+    def get_points_by_team(self, team_id):
+        points = 0
+        matches_played_1 = matches.query.filter_by(team_1_id=team_id, is_played=True).all()
+        matches_played_2 = matches.query.filter_by(team_2_id=team_id, is_played=True).all()
+        matches_played = matches_played_1 + matches_played_2
+        for match in matches_played:
+            if match.get_winner() == 'Draw':
+                points = points + 1
+            elif match.get_winner() == team_id:
+                points = points + 3
+        return points
+
+    def user_picked(self, user_id, group_id):
+        user_picks = picks.query.filter_by(user_id=user_id, group_id=group_id).first()
+        if user_picks:
+            return True
+        else:
+            return None
+
+    def get_first_seed(self, user_id, group_id):
+        first_pick = picks.query.filter_by(user_id=user_id, group_id=group_id).first()
+        if first_pick:
+            return country_cache.get(first_pick.first_seed_id)
+        else:
+            return None
+
+    def get_second_seed(self, user_id, group_id):
+        second_pick = picks.query.filter_by(user_id=user_id, group_id=group_id).first()
+        if second_pick:
+            return country_cache.get(second_pick.second_seed_id)
+        else:
+            return None
+
+    def get_country(self, team_id):
+        return country_cache.name(team_id)
+
+    def get_flag(self, team_id):
+        return country_cache.name(team_id).lower()
+
+    def team_ids(self):
+        return [team_id for team_id in (self.team_1_id, self.team_2_id, self.team_3_id, self.team_4_id)
+                if team_id is not None]
+
+    def set_team_points(self, team_id, points):
+        for position, group_team_id in enumerate(self.team_ids(), start=1):
+            if group_team_id == team_id:
+                setattr(self, f'team_{position}_points', points)
+
+    def get_username_by_id(self, user_id):
+        return users.query.filter_by(_id=user_id).first().name
+
+    def __init__(self, group_name, team_1_id, team_2_id, team_3_id, team_4_id, tournament_id=None):
+        self.group_name = group_name
+        self.team_1_id = team_1_id
+        self.team_2_id = team_2_id
+        self.team_3_id = team_3_id
+        self.team_4_id = team_4_id
+        self.tournament_id = tournament_id
+
+
+class tournaments(db.Model):
+    _id = db.Column("id", db.Integer, primary_key=True)
+    name = db.Column(db.String(500))
+
+    def __init__(self, name):
+        self.name = name
+
+
+class stages(db.Model):
+    # a knockout round: a correct pick for a match played between start_date and end_date (either may be open)
+    # is worth points
+    _id = db.Column("id", db.Integer, primary_key=True)
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'), index=True)
+    name = db.Column(db.String(500))
+    start_date = db.Column(db.Date)
+    end_date = db.Column(db.Date)
+    points = db.Column(db.Integer, default=1, nullable=False)
+
+    def __init__(self, tournament_id, name, start_date, end_date, points):
+        self.tournament_id = tournament_id
+        self.name = name
+        self.start_date = start_date
+        self.end_date = end_date
+        self.points = points
+
+
+class pools(db.Model):
+    # a group of players in one tournament with its own leaderboard
+    _id = db.Column("id", db.Integer, primary_key=True)
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'), index=True)
+    name = db.Column(db.String(500))
+
+    def __init__(self, tournament_id, name):
+        self.tournament_id = tournament_id
+        self.name = name
+
+
+class pool_members(db.Model):
+    pool_id = db.Column(db.Integer, db.ForeignKey('pools.id'), primary_key=True)
+    user_id = db.Column(db.String(500), db.ForeignKey('users.id'), primary_key=True, index=True)
+
+    def __init__(self, pool_id, user_id):
+        self.pool_id = pool_id
+        self.user_id = user_id
+
+
+class score_jobs(db.Model):
+    # queued score recomputations, see jobs.py. user_ids is a JSON list, NULL for every player of the tournament
+    __table_args__ = (
+        db.Index('ix_score_jobs_status_tournament', 'status', 'tournament_id'),
+    )
+    _id = db.Column("id", db.Integer, primary_key=True)
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'))
+    user_ids = db.Column(db.Text)
+    reason = db.Column(db.String(500))
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    worker = db.Column(db.String(500))
+    users_done = db.Column(db.Integer, default=0, nullable=False)
+    users_total = db.Column(db.Integer, default=0, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __init__(self, tournament_id, user_ids, reason):
+        self.tournament_id = tournament_id
+        self.user_ids = user_ids
+        self.reason = reason
+        self.status = 'pending'
+        self.users_done = 0
+        self.users_total = 0
+        self.attempts = 0
+        self.created_at = datetime.utcnow()
+
+
+class leaderboard_rosters(db.Model):
+    # the sorted user ids that the arrays of a leaderboard snapshot follow, shared by snapshots with the same players
+    __table_args__ = (
+        db.Index('ix_leaderboard_rosters_digest', 'tournament_id', 'digest'),
+    )
+    _id = db.Column("id", db.Integer, primary_key=True)
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'))
+    digest = db.Column(db.String(40), nullable=False)
+    user_count = db.Column(db.Integer, nullable=False)
+    user_ids = db.Column(db.LargeBinary, nullable=False)
+
+    def __init__(self, tournament_id, digest, user_count, user_ids):
+        self.tournament_id = tournament_id
+        self.digest = digest
+        self.user_count = user_count
+        self.user_ids = user_ids
+
+
+class leaderboard_snapshots(db.Model):
+    # the leaderboard after a score run, see snapshots.py. total_points and ranks are packed arrays in roster order
+    __table_args__ = (
+        db.Index('ix_leaderboard_snapshots_tournament', 'tournament_id', 'id'),
+    )
+    _id = db.Column("id", db.Integer, primary_key=True)
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'))
+    roster_id = db.Column(db.Integer, db.ForeignKey('leaderboard_rosters.id'), nullable=False)
+    taken_at = db.Column(db.DateTime, nullable=False)
+    matches_played = db.Column(db.Integer, default=0, nullable=False)
+    total_points = db.Column(db.LargeBinary, nullable=False)
+    ranks = db.Column(db.LargeBinary, nullable=False)
+
+    def __init__(self, tournament_id, roster_id, matches_played, total_points, ranks):
+        self.tournament_id = tournament_id
+        self.roster_id = roster_id
+        self.matches_played = matches_played
+        self.total_points = total_points
+        self.ranks = ranks
+        self.taken_at = datetime.utcnow()
+
+
+country_cache = CountryCache(lambda: db.session.query(countries._id, countries.name, countries.flag_name).all())
+
+
+@db.event.listens_for(countries, 'after_insert')
+@db.event.listens_for(countries, 'after_update')
+@db.event.listens_for(countries, 'after_delete')
+def invalidate_country_cache(mapper, connection, target):
+    country_cache.invalidate()
+
+
+def upsert(model, values, index_elements, update_columns=()):
+    # INSERT .. ON CONFLICT against one of the unique indexes, nothing is updated when update_columns is empty
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        existing = model.query.filter_by(**{column: values[column] for column in index_elements}).first()
+        if existing is None:
+            db.session.add(model(**values))
+        else:
+            for column in update_columns:
+                setattr(existing, column, values[column])
+        return
+    statement = insert(model).values(**values)
+    if update_columns:
+        statement = statement.on_conflict_do_update(
+            index_elements=index_elements, set_={column: statement.excluded[column] for column in update_columns})
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=index_elements)
+    db.session.execute(statement)
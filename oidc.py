@@ -0,0 +1,67 @@
+import re
+import time
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_MAX_AGE = 3600
+# (connect, read) in seconds for every call to the identity provider
+TIMEOUT = (3.05, 10)
+
+
+def make_session(pool_maxsize=10):
+    # keep-alive session shared by the login routes, GETs are retried on connection errors
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize,
+                          max_retries=Retry(total=2, backoff_factor=0.2, allowed_methods=['GET']))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def max_age(cache_control, default=DEFAULT_MAX_AGE):
+    if not cache_control:
+        return default
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0
+    match = re.search(r'max-age=(\d+)', cache_control)
+    if match:
+        return int(match.group(1))
+    return default
+
+
+class DiscoveryCache:
+    # OpenID discovery document, refreshed once its Cache-Control max-age runs out
+
+    def __init__(self, url, session, default_max_age=DEFAULT_MAX_AGE):
+        self.url = url
+        self.session = session
+        self.default_max_age = default_max_age
+        self.document = None
+        self.expires = 0
+        self.fetches = 0
+        self.lock = Lock()
+
+    def get(self):
+        if self.document is not None and time.monotonic() < self.expires:
+            return self.document
+        with self.lock:
+            if self.document is not None and time.monotonic() < self.expires:
+                return self.document
+            try:
+                response = self.session.get(self.url, timeout=TIMEOUT)
+                response.raise_for_status()
+            except requests.RequestException:
+                # a stale document beats failing every login while the provider is unreachable
+                if self.document is not None:
+                    return self.document
+                raise
+            self.fetches += 1
+            self.document = response.json()
+            self.expires = time.monotonic() + max_age(response.headers.get('Cache-Control'), self.default_max_age)
+            return self.document
+
+    def invalidate(self):
+        self.expires = 0
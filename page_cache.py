@@ -0,0 +1,76 @@
+import os
+import time
+from threading import Lock
+from types import SimpleNamespace
+
+from flask import current_app
+from markupsafe import Markup
+
+
+class PageCache:
+    # rendered fragments kept per process under a version key. The versions are tiny files, so a bump
+    # from one gunicorn worker is seen by every other worker on the host without asking the database.
+    # At most PAGE_CACHE_MAX_FRAGMENTS are kept, the least recently used go first. The fragments belong to the
+    # app in app.extensions, one instance serves every app built by create_app().
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        directory = app.config.setdefault('PAGE_CACHE_DIR', os.path.join(app.instance_path, 'page_cache'))
+        os.makedirs(directory, exist_ok=True)
+        app.config.setdefault('PAGE_CACHE_MAX_FRAGMENTS', 1000)
+        app.extensions['page_cache'] = SimpleNamespace(directory=directory, fragments={}, hits=0, misses=0,
+                                                       lock=Lock())
+
+    @property
+    def state(self):
+        return current_app.extensions['page_cache']
+
+    def version(self, name):
+        try:
+            with open(os.path.join(self.state.directory, name)) as version_file:
+                return version_file.read()
+        except FileNotFoundError:
+            return ''
+
+    def bump(self, *names):
+        for name in names:
+            path = os.path.join(self.state.directory, name)
+            temporary_path = f'{path}.{os.getpid()}'
+            with open(temporary_path, 'w') as version_file:
+                version_file.write(f'{time.time_ns()}-{os.getpid()}')
+            os.replace(temporary_path, path)
+
+    def get_or_render(self, name, render, key=None):
+        # key tells apart fragments that share the version name, e.g. the leaderboard of each pool
+        key = key or name
+        state = self.state
+        version = self.version(name)
+        cached = state.fragments.get(key)
+        if cached is not None and cached[0] == version:
+            state.hits += 1
+            with state.lock:
+                # dicts keep insertion order, moving the key to the end keeps the oldest lookups first
+                if state.fragments.pop(key, None) is not None:
+                    state.fragments[key] = cached
+            return cached[1]
+        state.misses += 1
+        html = Markup(render())
+        with state.lock:
+            state.fragments.pop(key, None)
+            while state.fragments and len(state.fragments) >= current_app.config['PAGE_CACHE_MAX_FRAGMENTS']:
+                del state.fragments[next(iter(state.fragments))]
+            state.fragments[key] = (version, html)
+        return html
+
+    def stats(self):
+        state = self.state
+        lookups = state.hits + state.misses
+        return {
+            'hits': state.hits,
+            'misses': state.misses,
+            'hit_rate': state.hits / lookups if lookups else 0.0,
+            'fragments': sorted(state.fragments),
+        }
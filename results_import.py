@@ -0,0 +1,41 @@
+import csv
+import io
+import json
+
+
+class ResultsImportError(ValueError):
+    pass
+
+
+def parse_results(text, filename=''):
+    # returns (match results, knockout results) from a JSON document or a CSV file
+    #   JSON: {"matches": [{"match_id": 1, "team_1_goals": 2, "team_2_goals": 0}, ...],
+    #          "knockout_matches": [{"knockout_match_id": 1, "winner": 3}, ...]}
+    #   CSV:  match_id,team_1_goals,team_2_goals,knockout_match_id,winner with one kind of result per row
+    if filename.endswith('.json') or text.lstrip().startswith('{'):
+        try:
+            document = json.loads(text)
+        except json.JSONDecodeError as error:
+            raise ResultsImportError(f'invalid JSON: {error}')
+        if not isinstance(document, dict):
+            raise ResultsImportError('expected a JSON object with "matches" and/or "knockout_matches"')
+        results = []
+        for key in ('matches', 'knockout_matches'):
+            rows = document.get(key, [])
+            if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                raise ResultsImportError(f'"{key}" must be a list with one object per result')
+            results.append(rows)
+        return results[0], results[1]
+
+    match_results = []
+    knockout_results = []
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not ({'match_id', 'knockout_match_id'} & set(reader.fieldnames)):
+        raise ResultsImportError('CSV needs a header with match_id and/or knockout_match_id')
+    for row in reader:
+        row = {key: value.strip() for key, value in row.items() if key and value is not None and value.strip() != ''}
+        if 'knockout_match_id' in row:
+            knockout_results.append(row)
+        elif 'match_id' in row:
+            match_results.append(row)
+    return match_results, knockout_results
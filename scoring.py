@@ -0,0 +1,80 @@
+from collections import Counter, defaultdict
+
+
+def pick_points(first_pick, second_pick, first_seed, second_seed):
+    # 3 points for 2 correct teams + order
+    # 2 points for 2 correct teams + incorrect order
+    # 1 point for 1 correct team in any order.
+    if first_pick == first_seed and second_pick == second_seed:
+        return 3
+    elif first_pick == second_seed and second_pick == first_seed:
+        return 2
+    elif first_pick == first_seed or first_pick == second_seed or second_pick == first_seed or second_pick == second_seed:
+        return 1
+    return 0
+
+
+def group_seeds(team_tuples):
+    # team_tuples is [(team_id, points), ...] in group order, ties go to the earlier team
+    team_tuples = list(team_tuples)
+    first_seed_tuple = max(team_tuples, key=lambda item: item[1])
+    team_tuples.remove(first_seed_tuple)
+    second_seed = max(team_tuples, key=lambda item: item[1])[0]
+    return first_seed_tuple[0], second_seed
+
+
+def knockout_match_points(match_date, stage_list):
+    # stage_list: [(start_date, end_date, points), ...] of the tournament's knockout stages, either date may be None
+    for start_date, end_date, points in stage_list:
+        if (start_date is None or match_date >= start_date) and (end_date is None or match_date <= end_date):
+            return points
+    return 1
+
+
+def complete_group_played(team_count):
+    # team-matches in a finished round robin: every team plays every other team once, 12 for a group of four
+    return team_count * (team_count - 1)
+
+
+def match_result(team_1_goals, team_2_goals):
+    # standings contribution of one result per team: (played, won, drawn, lost, goals_for, goals_against, points)
+    if team_1_goals == team_2_goals:
+        return (1, 0, 1, 0, team_1_goals, team_2_goals, 1), (1, 0, 1, 0, team_2_goals, team_1_goals, 1)
+    elif team_1_goals > team_2_goals:
+        return (1, 1, 0, 0, team_1_goals, team_2_goals, 3), (1, 0, 0, 1, team_2_goals, team_1_goals, 0)
+    else:
+        return (1, 0, 0, 1, team_1_goals, team_2_goals, 0), (1, 1, 0, 0, team_2_goals, team_1_goals, 3)
+
+
+def group_points(group_list, played, pick_list):
+    # group_list: [(group_id, [(team_id, points), ...]), ...] of one tournament
+    # played: {team_id: matches played}
+    # pick_list: [(user_id, group_id, first_seed_id, second_seed_id), ...] ordered by pick id
+    seeds = {}
+    for group_id, team_tuples in group_list:
+        if sum(played.get(team_id, 0) for team_id, _ in team_tuples) == complete_group_played(len(team_tuples)):
+            seeds[group_id] = group_seeds(team_tuples)
+
+    pick_count = Counter()
+    first_picks = defaultdict(dict)
+    for user_id, group_id, first_seed_id, second_seed_id in pick_list:
+        pick_count[user_id] += 1
+        first_picks[user_id].setdefault(group_id, (first_seed_id, second_seed_id))
+
+    points = {}
+    for user_id, user_picks in first_picks.items():
+        points[user_id] = 0
+        if pick_count[user_id] != len(group_list):
+            continue
+        for group_id, (first_seed, second_seed) in seeds.items():
+            if group_id in user_picks:
+                points[user_id] += pick_points(*user_picks[group_id], first_seed, second_seed)
+    return points
+
+
+def knockout_points(correct_picks, stage_list):
+    # correct_picks: [(user_id, match_date, count), ...] of picks that match the played winner
+    points = Counter()
+    for user_id, match_date, count in correct_picks:
+        points[user_id] += knockout_match_points(match_date, stage_list) * count
+    return points
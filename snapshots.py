@@ -0,0 +1,129 @@
+# The leaderboard is recorded after every score run that changes it. A snapshot is two zlib packed int32 arrays,
+# total points and rank per player, in the order of a roster of sorted user ids that is stored once and shared by
+# every snapshot with the same players. 10000 players cost a few kilobytes per snapshot, and a player's history or
+# the movers between two match days come from unpacking arrays instead of replaying the tournament.
+import bisect
+import hashlib
+import zlib
+
+import numpy as np
+
+from models import db, knockout_matches, leaderboard_rosters, leaderboard_snapshots, matches, scores
+
+
+def pack(values):
+    return zlib.compress(np.asarray(values, dtype='<i4').tobytes())
+
+
+def unpack(blob):
+    return np.frombuffer(zlib.decompress(blob), dtype='<i4')
+
+
+def pack_user_ids(user_ids):
+    return zlib.compress('\n'.join(user_ids).encode())
+
+
+def unpack_user_ids(blob):
+    text = zlib.decompress(blob).decode()
+    return text.split('\n') if text else []
+
+
+def roster_id(tournament_id, user_ids):
+    digest = hashlib.sha1('\n'.join(user_ids).encode()).hexdigest()
+    existing = db.session.query(leaderboard_rosters._id).filter_by(tournament_id=tournament_id, digest=digest) \
+        .order_by(leaderboard_rosters._id).limit(1).scalar()
+    if existing is not None:
+        return existing
+    roster = leaderboard_rosters(tournament_id, digest, len(user_ids), pack_user_ids(user_ids))
+    db.session.add(roster)
+    db.session.flush()
+    return roster._id
+
+
+def take(tournament_id):
+    # records the tournament's leaderboard, returns None when it is the same as in the last snapshot
+    # sorted here rather than in SQL, the database collation may not order the ids like bisect does
+    rows = sorted(db.session.query(scores.user_id, scores.total_points, scores.rank)
+                  .filter(scores.tournament_id == tournament_id).all())
+    user_ids = [user_id for user_id, _, _ in rows]
+    total_points = pack([total for _, total, _ in rows])
+    ranks = pack([rank or 0 for _, _, rank in rows])
+    roster = roster_id(tournament_id, user_ids)
+    last = leaderboard_snapshots.query.filter_by(tournament_id=tournament_id) \
+        .order_by(leaderboard_snapshots._id.desc()).first()
+    if last is not None and (last.roster_id, last.total_points, last.ranks) == (roster, total_points, ranks):
+        db.session.rollback()
+        return None
+    matches_played = db.session.query(db.func.count(matches._id)) \
+        .filter_by(tournament_id=tournament_id, is_played=True).scalar() + \
+        db.session.query(db.func.count(knockout_matches._id)) \
+        .filter_by(tournament_id=tournament_id, is_played=True).scalar()
+    snapshot = leaderboard_snapshots(tournament_id, roster, matches_played, total_points, ranks)
+    db.session.add(snapshot)
+    db.session.commit()
+    return snapshot
+
+
+def snapshot_list(tournament_id):
+    # (id, taken_at, matches_played, players) of every snapshot, oldest first, without the arrays
+    return db.session.query(leaderboard_snapshots._id, leaderboard_snapshots.taken_at,
+                            leaderboard_snapshots.matches_played, leaderboard_rosters.user_count) \
+        .join(leaderboard_rosters, leaderboard_rosters._id == leaderboard_snapshots.roster_id) \
+        .filter(leaderboard_snapshots.tournament_id == tournament_id).order_by(leaderboard_snapshots._id).all()
+
+
+def rosters(roster_ids):
+    return {roster_id: unpack_user_ids(user_ids) for roster_id, user_ids in db.session.query(
+        leaderboard_rosters._id, leaderboard_rosters.user_ids).filter(leaderboard_rosters._id.in_(roster_ids))}
+
+
+def history(tournament_id, user_id):
+    # [(snapshot, total_points, rank), ...] of one player, oldest first, from the snapshots that include them. rank
+    # is None while they were off the leaderboard.
+    snapshot_rows = leaderboard_snapshots.query.filter_by(tournament_id=tournament_id) \
+        .order_by(leaderboard_snapshots._id).all()
+    positions = {}
+    for roster, user_ids in rosters({snapshot.roster_id for snapshot in snapshot_rows}).items():
+        position = bisect.bisect_left(user_ids, user_id)
+        if position < len(user_ids) and user_ids[position] == user_id:
+            positions[roster] = position
+    return [(snapshot, int(unpack(snapshot.total_points)[positions[snapshot.roster_id]]),
+             int(unpack(snapshot.ranks)[positions[snapshot.roster_id]]) or None)
+            for snapshot in snapshot_rows if snapshot.roster_id in positions]
+
+
+def movers(tournament_id, before_id=None, after_id=None, limit=10):
+    # (before, after, risers, fallers) between two snapshots, by default the last two. risers and fallers are
+    # [(user_id, rank_before, rank_after, points_gained), ...] with the biggest rank change first. None when the
+    # tournament has fewer than two snapshots.
+    query = leaderboard_snapshots.query.filter_by(tournament_id=tournament_id)
+    after = query.filter_by(_id=after_id).first() if after_id else \
+        query.order_by(leaderboard_snapshots._id.desc()).first()
+    if after is None:
+        return None
+    before = query.filter_by(_id=before_id).first() if before_id else \
+        query.filter(leaderboard_snapshots._id < after._id).order_by(leaderboard_snapshots._id.desc()).first()
+    if before is None:
+        return None
+    user_ids = rosters({before.roster_id, after.roster_id})
+    before_ids = np.array(user_ids[before.roster_id], dtype=object)
+    after_ids = np.array(user_ids[after.roster_id], dtype=object)
+    # players who joined after the earlier snapshot have no rank to move from, rank 0 is a player off the board
+    position = np.searchsorted(before_ids, after_ids) if len(before_ids) else np.zeros(len(after_ids), dtype=int)
+    found = position < len(before_ids)
+    found[found] = before_ids[position[found]] == after_ids[found]
+    found[found] = (unpack(before.ranks)[position[found]] > 0) & (unpack(after.ranks)[found] > 0)
+    rank_before = unpack(before.ranks)[position[found]]
+    rank_after = unpack(after.ranks)[found]
+    gained = unpack(after.total_points)[found] - unpack(before.total_points)[position[found]]
+    change = rank_before - rank_after
+    moved_ids = after_ids[found]
+
+    def top(order, moved):
+        return [(moved_ids[index], int(rank_before[index]), int(rank_after[index]), int(gained[index]))
+                for index in order[moved[order]][:limit]]
+
+    # lexsort sorts by its last key first, ties go to the better rank now
+    risers = top(np.lexsort((rank_after, -change)), change > 0)
+    fallers = top(np.lexsort((rank_after, change)), change < 0)
+    return before, after, risers, fallers
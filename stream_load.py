@@ -0,0 +1,172 @@
+# Load test for the live scoreboard stream.
+#
+#   python stream_load.py --listeners 3000
+#   LIVE_STREAM=1 gunicorn -k gevent --worker-connections 6000 -b :8001 wsgi:app &
+#   python stream_load.py --url http://127.0.0.1:8001 --listeners 5000
+#
+# Without --url it generates a tournament in a throwaway SQLite file (see bench.py) and starts a gevent worker on
+# it. With --url the server has to use the same DATABASE_URL and SECRET_KEY and run on this host, since the results
+# are entered from here. Every listener logs in with a signed session cookie, then the remaining group results are
+# imported as one match day and the script reports how long each listener took to receive the scoreboard change.
+import argparse
+import asyncio
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from bench import generate_tournament, percentile
+
+
+async def listen(host, port, cookie, connected, received):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f'GET /stream HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n'
+                     f'Accept: text/event-stream\r\n\r\n'.encode())
+        await writer.drain()
+        status = await reader.readline()
+        if b' 200 ' not in status:
+            raise ConnectionError(status.decode().strip())
+        while (await reader.readline()).strip():
+            pass
+        while not (await reader.readline()).startswith(b'retry:'):
+            pass
+        connected()
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError('stream closed')
+            if line.startswith(b'event: scoreboard'):
+                received.append(time.perf_counter())
+                return
+    finally:
+        writer.close()
+
+
+def enter_results(world_cup, app):
+    # imports the remaining group matches as one match day, which completes groups and so changes the scoreboard
+    with app.app_context():
+        match_list = world_cup.matches.query.filter_by(is_played=False).all()
+        errors, changes = world_cup.import_results(
+            app.config['DEFAULT_TOURNAMENT_ID'],
+            [dict(match_id=match._id, team_1_goals=2, team_2_goals=1) for match in match_list], [])
+        if errors:
+            raise SystemExit(errors)
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f'nothing listening on {host}:{port}')
+
+
+async def run(world_cup, app, host, port, listener_count, connect_concurrency):
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookie_name = app.config['SESSION_COOKIE_NAME']
+    user_id = str(100000000000)
+    cookie = cookie_name + '=' + serializer.dumps(dict(_user_id=user_id, _fresh=True, id=user_id, name='User 0'))
+
+    settled = asyncio.Event()
+    connected_count = 0
+    failures = []
+    received = []
+    limit = asyncio.Semaphore(connect_concurrency)
+
+    def settle():
+        if connected_count + len(failures) == listener_count:
+            settled.set()
+
+    async def one_listener():
+        await limit.acquire()
+        is_connected = False
+
+        def connected():
+            nonlocal connected_count, is_connected
+            is_connected = True
+            connected_count += 1
+            limit.release()
+            settle()
+
+        try:
+            await listen(host, port, cookie, connected, received)
+        except Exception as error:
+            if not is_connected:
+                limit.release()
+                failures.append(error)
+                settle()
+
+    started = time.perf_counter()
+    tasks = [asyncio.ensure_future(one_listener()) for _ in range(listener_count)]
+    await settled.wait()
+    if failures:
+        print(f'{len(failures)} listeners failed to connect, first error: {failures[0]!r}', file=sys.stderr)
+    print(f'{connected_count} listeners connected in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+    # let the poller take the snapshot the change is compared against
+    await asyncio.sleep(2 * app.config['LIVE_POLL_INTERVAL'])
+    entered = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(None, enter_results, world_cup, app)
+    await asyncio.wait(tasks, timeout=30)
+    for task in tasks:
+        task.cancel()
+
+    latencies = [(moment - entered) * 1000 for moment in received]
+    print(f'{len(received)}/{connected_count} listeners received the scoreboard change', file=sys.stderr)
+    if latencies:
+        print(f'p50 {percentile(latencies, 0.5):8.1f} ms  p90 {percentile(latencies, 0.9):8.1f} ms  '
+              f'p99 {percentile(latencies, 0.99):8.1f} ms  max {max(latencies):8.1f} ms')
+    return len(received) == listener_count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Hold many /stream listeners and time one scoreboard push.')
+    parser.add_argument('--listeners', type=int, default=3000)
+    parser.add_argument('--users', type=int, default=1000, help='users in the generated tournament')
+    parser.add_argument('--url', help='a stream worker that is already running, instead of starting one')
+    parser.add_argument('--port', type=int, default=8765, help='port for the worker this script starts')
+    parser.add_argument('--connect-concurrency', type=int, default=200, help='connections opened at once')
+    args = parser.parse_args(argv)
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.listeners + 100 and (hard == resource.RLIM_INFINITY or hard >= args.listeners + 100):
+        resource.setrlimit(resource.RLIMIT_NOFILE, (args.listeners + 100, hard))
+
+    server = None
+    if not args.url:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'stream.sqlite')
+    import app as world_cup
+    app = world_cup.create_app()
+    try:
+        if args.url:
+            address = urlsplit(args.url)
+            host, port = address.hostname, address.port or 80
+        else:
+            host, port = '127.0.0.1', args.port
+            with app.app_context():
+                generate_tournament(world_cup, args.users)
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '-k', 'gevent', '-w', '1', '--worker-connections',
+                 str(args.listeners + 100), '--backlog', str(args.connect_concurrency * 2), '-b', f'{host}:{port}',
+                 'wsgi:app'],
+                env=dict(os.environ, LIVE_STREAM='1'))
+        wait_for_port(host, port)
+        ok = asyncio.run(run(world_cup, app, host, port, args.listeners, args.connect_concurrency))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# Local stand-in for Google's OpenID provider, for running the login flow without Google.
+#
+#   python stub_idp.py
+#   OAUTHLIB_INSECURE_TRANSPORT=1 GOOGLE_DISCOVERY_URL=http://localhost:5001/.well-known/openid-configuration \
+#       GOOGLE_CLIENT_ID=stub GOOGLE_CLIENT_SECRET=stub flask run
+#
+# /authorize signs in as the user given by the sub, email and given_name query parameters, or a default test user.
+import secrets
+from urllib.parse import urlencode
+
+from flask import Flask, redirect, request
+
+stub = Flask(__name__)
+codes = {}
+tokens = {}
+
+DEFAULT_USER = dict(sub='100000000000', email='test.user@example.com', given_name='Test', email_verified=True)
+
+
+@stub.route('/.well-known/openid-configuration')
+def discovery():
+    base = request.host_url.rstrip('/')
+    document = dict(
+        issuer=base,
+        authorization_endpoint=base + '/authorize',
+        token_endpoint=base + '/token',
+        userinfo_endpoint=base + '/userinfo',
+    )
+    return document, 200, {'Cache-Control': 'public, max-age=3600'}
+
+
+@stub.route('/authorize')
+def authorize():
+    code = secrets.token_urlsafe(16)
+    codes[code] = dict(DEFAULT_USER, **{key: request.args[key] for key in ('sub', 'email', 'given_name')
+                                        if key in request.args})
+    query = dict(code=code)
+    if 'state' in request.args:
+        query['state'] = request.args['state']
+    return redirect(request.args['redirect_uri'] + '?' + urlencode(query))
+
+
+@stub.route('/token', methods=['POST'])
+def token():
+    user = codes.pop(request.form.get('code'), None)
+    if user is None:
+        return dict(error='invalid_grant'), 400
+    access_token = secrets.token_urlsafe(16)
+    tokens[access_token] = user
+    return dict(access_token=access_token, token_type='Bearer', expires_in=3600)
+
+
+@stub.route('/userinfo')
+def userinfo():
+    access_token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    user = tokens.get(access_token)
+    if user is None:
+        return dict(error='invalid_token'), 401
+    return user
+
+
+if __name__ == '__main__':
+    stub.run(port=5001)
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as world_cup
+from models import db
+
+
+@pytest.fixture
+def app(tmp_path):
+    test_app = world_cup.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SCORE_WORKER': 'inline',
+                                     'PAGE_CACHE_DIR': str(tmp_path / 'page_cache')})
+    with test_app.app_context():
+        db.create_all()
+        yield test_app
@@ -0,0 +1,17 @@
+import pytest
+
+import app as world_cup
+import migrations
+from bench import generate_tournament
+
+
+@pytest.fixture
+def seeded(app):
+    generate_tournament(world_cup, 200)
+    world_cup.update_scores(app.config['DEFAULT_TOURNAMENT_ID'])
+    return app
+
+
+def test_hot_paths_use_an_index(seeded):
+    for name, plan, uses_index in migrations.explain_hot_paths(user_id='100000000000'):
+        assert uses_index, f'{name}:\n{plan}'
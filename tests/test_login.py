@@ -0,0 +1,89 @@
+from collections import Counter
+from urllib.parse import urlsplit
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+import app as world_cup
+import oidc
+import stub_idp
+from models import users
+
+IDP = 'http://idp.test'
+
+
+class StubResponse(requests.Response):
+    parsed = Counter()
+
+    def json(self, **kwargs):
+        StubResponse.parsed[urlsplit(self.url).path] += 1
+        return super().json(**kwargs)
+
+
+class StubAdapter(BaseAdapter):
+    # answers the app's calls to the identity provider from stub_idp through its test client, no sockets
+    def __init__(self):
+        super().__init__()
+        self.client = stub_idp.stub.test_client()
+        self.calls = Counter()
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        self.calls[url.path] += 1
+        reply = self.client.open(url.path, method=request.method, query_string=url.query, headers=dict(request.headers),
+                                 data=request.body, base_url=IDP)
+        response = StubResponse()
+        response.status_code = reply.status_code
+        response.headers = requests.structures.CaseInsensitiveDict(reply.headers)
+        response._content = reply.get_data()
+        response.url = request.url
+        response.request = request
+        response.encoding = 'utf-8'
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def idp(app, monkeypatch):
+    monkeypatch.setenv('OAUTHLIB_INSECURE_TRANSPORT', '1')
+    monkeypatch.setattr(world_cup, 'GOOGLE_CLIENT_ID', 'stub')
+    monkeypatch.setattr(world_cup, 'GOOGLE_CLIENT_SECRET', 'stub')
+    adapter = StubAdapter()
+    http_session = oidc.make_session()
+    http_session.mount(IDP, adapter)
+    monkeypatch.setattr(world_cup, 'http_session', http_session)
+    monkeypatch.setattr(world_cup, 'google_provider_cfg_cache',
+                        oidc.DiscoveryCache(IDP + '/.well-known/openid-configuration', http_session))
+    StubResponse.parsed.clear()
+    return adapter
+
+
+def log_in(client, **user):
+    authorize = client.get('/login')
+    assert authorize.status_code == 302 and authorize.location.startswith(IDP + '/authorize')
+    url = urlsplit(authorize.location)
+    callback = stub_idp.stub.test_client().get(url.path, query_string=url.query + '&' + '&'.join(
+        f'{key}={value}' for key, value in user.items()), base_url=IDP)
+    assert callback.status_code == 302
+    return client.get(callback.location)
+
+
+def test_login_through_the_stub_provider(app, idp):
+    client = app.test_client()
+    response = log_in(client)
+    assert response.status_code == 302 and response.location == '/'
+    with client.session_transaction() as session:
+        assert session['id'] == stub_idp.DEFAULT_USER['sub']
+    assert users.query.filter_by(_id=stub_idp.DEFAULT_USER['sub']).one().name == 'Test'
+
+    log_in(app.test_client(), sub='100000000001', email='second@example.com', given_name='Second')
+    assert users.query.filter_by(_id='100000000001').one().name == 'Second'
+    # two logins, one discovery fetch, and each login reads and parses userinfo once
+    assert idp.calls['/.well-known/openid-configuration'] == 1
+    assert world_cup.google_provider_cfg_cache.fetches == 1
+    assert idp.calls['/token'] == 2
+    assert idp.calls['/userinfo'] == 2
+    assert StubResponse.parsed['/userinfo'] == 2
@@ -0,0 +1,62 @@
+from datetime import date
+
+import pytest
+
+import app as world_cup
+from bench import generate_tournament
+from models import db, users, knockout_matches, picks, groups
+
+
+@pytest.fixture
+def tournament(app):
+    # knockout match days 2022-12-03 to 2022-12-18, both sides of the 2022-12-11 change from 1 to 2 points
+    generate_tournament(world_cup, 300, knockout_start=date(2022, 12, 3))
+    last_matches = knockout_matches.query.order_by(knockout_matches._id.desc()).limit(3).all()
+    for match in last_matches:
+        match.is_played = False
+        match.winner = None
+    # some players are missing a pick and score no group points
+    last_group = groups.query.order_by(groups._id.desc()).first()
+    picks.query.filter(picks.user_id.in_([str(100000000000 + index) for index in range(0, 300, 7)]),
+                       picks.group_id == last_group._id).delete(synchronize_session=False)
+    db.session.commit()
+    return app.config['DEFAULT_TOURNAMENT_ID']
+
+
+def test_knockout_dates_cover_both_stages(tournament):
+    played_dates = [match_date for (match_date,) in db.session.query(knockout_matches.match_date)
+                    .filter_by(is_played=True)]
+    assert min(played_dates) <= date(2022, 12, 11) < max(played_dates)
+
+
+def test_bulk_scoring_matches_per_user_methods(tournament):
+    all_points = world_cup.calc_all_points(tournament)
+    user_list = users.query.all()
+    assert len(user_list) == 300
+    for user in user_list:
+        assert all_points.get(user._id, (0, 0)) == (user.calc_points(), user.knockout_points()), user._id
+
+
+def test_scores_table_matches_per_user_methods(tournament):
+    world_cup.update_scores(tournament)
+    stored = {score.user_id: (score.group_points, score.knockout_points)
+              for score in world_cup.scores.query.filter_by(tournament_id=tournament)}
+    for user in users.query.all():
+        assert stored[user._id] == (user.calc_points(), user.knockout_points()), user._id
+
+
+def test_ranks_follow_the_leaderboard(tournament):
+    # players without group points are not on the board, they must not take up ranks
+    picks.query.filter(picks.user_id.in_([str(100000000000 + index) for index in range(1, 300, 11)])) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    world_cup.update_scores(tournament)
+    rows, _ = world_cup.leaderboard_page(tournament, limit=300)
+    previous = None
+    for position, (score, _) in enumerate(rows, start=1):
+        expected = previous.rank if previous and previous.total_points == score.total_points else position
+        assert score.rank == expected, score.user_id
+        previous = score
+    hidden = world_cup.scores.query.filter_by(tournament_id=tournament, group_points=0).all()
+    assert hidden and all(score.rank is None for score in hidden)
+    assert world_cup.leaderboard_around(tournament, hidden[0].user_id)[1] is None
@@ -0,0 +1,11 @@
+# the module level app for servers and 'flask', app.py only builds apps: gunicorn wsgi:app
+from app import create_app
+from models import db
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        db.create_all()
+    app.run(ssl_context="adhoc")